@@ -0,0 +1,54 @@
+"""
+Helpers shared by the benchmark scripts
+"""
+
+import os
+import shutil
+import time
+
+
+TEST_PACKAGES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                 "..", "tests", "test_dir2module", "packages")
+
+
+def measure(func, repeat):
+    """
+    Call `func` `repeat` times and return the best elapsed time in seconds,
+    and the result of the last call
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def create_tree(root, depth, fanout, filenames):
+    """
+    Create a tree of directories with `fanout` subdirectories each, `depth`
+    levels deep, each of them containing empty files named `filenames`
+    """
+    def create(directory, level):
+        os.makedirs(directory, exist_ok=True)
+        for filename in filenames:
+            open(os.path.join(directory, filename), "w").close()
+        if level < depth:
+            for i in range(fanout):
+                create(os.path.join(directory, "d{0}".format(i)), level + 1)
+    create(root, 0)
+
+
+def copy_test_packages(root, copies):
+    """
+    Copy the dir2module test packages into `root` directory `copies` times
+    """
+    sources = [os.path.join(TEST_PACKAGES_DIR, name)
+               for name in sorted(os.listdir(TEST_PACKAGES_DIR))
+               if name.endswith(".rpm")]
+    for i in range(copies):
+        for source in sources:
+            name = "{0}-{1}".format(i, os.path.basename(source))
+            shutil.copy(source, os.path.join(root, name))
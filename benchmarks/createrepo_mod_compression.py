@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+
+"""
+Compare compression types available for `createrepo_mod
+--modules-compress-type` on a real (merged) modules.yaml file.
+
+For each compression type, the size of the compressed file, the compression
+time and the decompression time is measured. Single-threaded compression is
+done through the `createrepo_c` Python bindings, the same way as
+`modifyrepo_c` does it, multi-threaded compression through `xz` and `zstd`.
+
+Usage:
+
+    python3 benchmarks/createrepo_mod_compression.py modules.yaml [--threads N]
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+
+import createrepo_c as cr
+
+from common import measure
+
+
+def bench_library(src, workdir, compress_type, repeat):
+    compression = cr.compression_type(compress_type)
+    dst = os.path.join(workdir, "modules.yaml" + cr.compression_suffix(compression))
+    out = os.path.join(workdir, "modules.yaml.out")
+    ctime, _ = measure(lambda: cr.compress_file(src, dst, compression), repeat)
+    dtime, _ = measure(lambda: cr.decompress_file(dst, out, compression), repeat)
+    return os.path.getsize(dst), ctime, dtime
+
+
+def bench_parallel(src, workdir, compress_type, threads, repeat):
+    tool, suffix = {"xz": ("xz", ".xz"), "zstd": ("zstd", ".zst")}[compress_type]
+    dst = os.path.join(workdir, "modules.yaml" + suffix)
+
+    def compress():
+        with open(dst, "wb") as f:
+            subprocess.run([tool, "-q", "-c", "-T{0}".format(threads), src],
+                           stdout=f, check=True)
+
+    def decompress():
+        subprocess.run([tool, "-q", "-d", "-c", dst],
+                       stdout=subprocess.DEVNULL, check=True)
+
+    ctime, _ = measure(compress, repeat)
+    dtime, _ = measure(decompress, repeat)
+    return os.path.getsize(dst), ctime, dtime
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules_yaml")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Threads for xz and zstd, 0 means all CPU cores")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    size = os.path.getsize(args.modules_yaml)
+    print("{0}: {1} bytes".format(args.modules_yaml, size))
+    print("{0:<16} {1:>12} {2:>7} {3:>12} {4:>12}".format(
+        "compression", "size", "ratio", "compress", "decompress"))
+
+    workdir = tempfile.mkdtemp()
+    try:
+        results = []
+        for compress_type in ["gz", "bz2", "xz", "zstd"]:
+            results.append((compress_type, bench_library(
+                args.modules_yaml, workdir, compress_type, args.repeat)))
+        for compress_type in ["xz", "zstd"]:
+            if not shutil.which(compress_type):
+                continue
+            label = "{0} -T{1}".format(compress_type, args.threads)
+            results.append((label, bench_parallel(
+                args.modules_yaml, workdir, compress_type, args.threads,
+                args.repeat)))
+    finally:
+        shutil.rmtree(workdir)
+
+    for label, (csize, ctime, dtime) in results:
+        print("{0:<16} {1:>12} {2:>6.1f}% {3:>11.3f}s {4:>11.3f}s".format(
+            label, csize, 100.0 * csize / size, ctime, dtime))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+
+"""
+Compare the single-threaded `os.walk` search for module YAML files, which
+`createrepo_mod` used originally, with the parallel `os.scandir` based
+`scan_directory` on a synthetic deep directory tree.
+
+The difference is most visible on network filesystems, so consider pointing
+`--root` to an NFS mount.
+
+Usage:
+
+    python3 benchmarks/createrepo_mod_scan.py [--root DIR] [--workers 1 4 16]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+
+from common import create_tree, measure
+from modulemd_tools.createrepo_mod.createrepo_mod import (
+    DEFAULT_SCAN_EXCLUDES, scan_directory)
+
+
+def walk(path):
+    matches = []
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            if filename.endswith((".yaml", ".yaml.gz")):
+                matches.append(os.path.join(root, filename))
+    return matches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", help="Where to create the tree (default: /tmp)")
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--fanout", type=int, default=6)
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(dir=args.root)
+    try:
+        # Every directory contains RPM-like files and one YAML file
+        filenames = ["pkg-{0}.rpm".format(i) for i in range(args.files)]
+        create_tree(root, args.depth, args.fanout, filenames + ["module.yaml"])
+        elapsed, found = measure(lambda: walk(root), args.repeat)
+        print("{0:<24} {1:>8.3f}s  ({2} YAML files)".format("os.walk", elapsed, len(found)))
+        for workers in args.workers:
+            elapsed, found = measure(lambda: scan_directory(
+                root, (".yaml", ".yaml.gz"), workers=workers,
+                excludes=DEFAULT_SCAN_EXCLUDES), args.repeat)
+            label = "scan_directory -j{0}".format(workers)
+            print("{0:<24} {1:>8.3f}s  ({2} YAML files)".format(label, elapsed, len(found)))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+
+"""
+Compare the `os.walk` and `fnmatch` based search for RPM packages, which
+`dir2module` used originally, with the `os.scandir` based `find_packages`
+on a synthetic directory tree (of about 100k files by default).
+
+The difference of multiple workers is most visible on network filesystems,
+so consider pointing `--root` to an NFS mount.
+
+Usage:
+
+    python3 benchmarks/dir2module_find.py [--root DIR] [--workers 1 4 16]
+"""
+
+import argparse
+import fnmatch
+import os
+import shutil
+import tempfile
+
+from common import create_tree, measure
+from modulemd_tools.dir2module.dir2module import find_packages
+
+
+def walk(path):
+    packages = []
+    for root, _, filenames in os.walk(path):
+        for filename in fnmatch.filter(filenames, "*.rpm"):
+            if filename.endswith(".src.rpm"):
+                continue
+            packages.append(os.path.join(root, filename))
+    return packages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", help="Where to create the tree (default: /tmp)")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fanout", type=int, default=10)
+    parser.add_argument("--files", type=int, default=90)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(dir=args.root)
+    try:
+        # Every directory contains RPM files and a source RPM
+        filenames = ["pkg{0}-1-1.x86_64.rpm".format(i) for i in range(args.files)]
+        create_tree(root, args.depth, args.fanout, filenames + ["pkg-1-1.src.rpm"])
+        elapsed, found = measure(lambda: walk(root), args.repeat)
+        print("{0:<24} {1:>8.3f}s  ({2} packages)".format("os.walk", elapsed, len(found)))
+        for workers in args.workers:
+            elapsed, found = measure(lambda: find_packages(root, workers=workers),
+                                     args.repeat)
+            label = "find_packages -j{0}".format(workers)
+            print("{0:<24} {1:>8.3f}s  ({2} packages)".format(label, elapsed, len(found)))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
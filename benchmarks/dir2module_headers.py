@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+
+"""
+Compare the per-package cost of reading RPM headers in `dir2module` with
+a new `rpm.TransactionSet` (and keyring) created for every package, which
+is what `dir2module` did originally, and with the shared `HeaderReader`.
+
+Without `--dir`, the test packages are copied into a temporary directory
+`--copies` times.
+
+Usage:
+
+    python3 benchmarks/dir2module_headers.py [--dir DIR] [--copies 1000]
+"""
+
+import argparse
+import shutil
+import tempfile
+
+import rpm
+
+from common import copy_test_packages, measure
+from modulemd_tools.dir2module.dir2module import HeaderReader, find_packages
+
+
+def read_header_new_ts(path):
+    ts = rpm.TransactionSet()
+    ts.setKeyring(rpm.keyring())
+    ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES | rpm._RPMVSF_NODIGESTS)
+    with open(path, "r") as f:
+        return ts.hdrFromFdno(f.fileno())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dir", help="Directory with RPM packages")
+    parser.add_argument("--copies", type=int, default=1000,
+                        help="How many times to copy the test packages without --dir")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    root = None
+    if not args.dir:
+        root = tempfile.mkdtemp()
+        copy_test_packages(root, args.copies)
+    try:
+        paths = find_packages(args.dir or root)
+        reader = HeaderReader()
+        for label, func in [("TransactionSet per package", read_header_new_ts),
+                            ("HeaderReader", reader.read)]:
+            elapsed, _ = measure(lambda: [func(path) for path in paths], args.repeat)
+            print("{0:<28} {1:>8.3f}s  {2:>8.1f}us per package".format(
+                label, elapsed, elapsed / len(paths) * 1e6))
+    finally:
+        if root:
+            shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
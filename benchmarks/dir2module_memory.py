@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+
+"""
+Compare the memory needed for loading RPM packages in `dir2module` while
+keeping their whole `rpm.hdr` headers alive, which is what `dir2module`
+did originally, and with the compact `Package` records.
+
+Each variant runs in its own process and the peak RSS growth is reported.
+Without `--dir`, the test packages are copied into a temporary directory
+`--copies` times.
+
+Usage:
+
+    python3 benchmarks/dir2module_memory.py [--dir DIR] [--copies 5000]
+"""
+
+import argparse
+import json
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from common import copy_test_packages
+from modulemd_tools.dir2module.dir2module import Package, find_packages, read_header
+
+
+def peak_rss():
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def load(variant, path):
+    """
+    Load all packages from `path` and print the peak RSS growth in kilobytes
+    """
+    paths = find_packages(path)
+    before = peak_rss()
+    if variant == "headers":
+        packages = [(path, read_header(path)) for path in paths]
+    else:
+        packages = [Package(path) for path in paths]
+    print(json.dumps({"packages": len(packages), "rss": peak_rss() - before}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dir", help="Directory with RPM packages")
+    parser.add_argument("--copies", type=int, default=5000,
+                        help="How many times to copy the test packages without --dir")
+    parser.add_argument("--variant", choices=["headers", "packages"],
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        load(args.variant, args.dir)
+        return
+
+    root = None
+    if not args.dir:
+        root = tempfile.mkdtemp()
+        copy_test_packages(root, args.copies)
+    try:
+        for variant, label in [("headers", "whole rpm.hdr"), ("packages", "Package")]:
+            output = subprocess.check_output([
+                sys.executable, __file__, "--variant", variant,
+                "--dir", args.dir or root])
+            result = json.loads(output.decode("utf-8"))
+            print("{0:<16} {1:>10.1f} MiB  {2:>8.2f} KiB per package".format(
+                label, result["rss"] / 1024, result["rss"] / result["packages"]))
+    finally:
+        if root:
+            shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
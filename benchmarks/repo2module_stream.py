@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+
+"""
+Measure the per-package overhead of building a module stream in
+`repo2module`. The original approach called `add_rpm_artifact`, `add_rpm_api`
+and `Profile.add_rpm` for every parsed package, including the duplicate
+names of packages with multiple versions or architectures.
+`create_module` adds the deduplicated and sorted values from a `RepoContent`
+instead.
+
+Usage:
+
+    python3 benchmarks/repo2module_stream.py [--packages 50000] [--versions 3]
+"""
+
+import argparse
+
+import gi
+gi.require_version('Modulemd', '2.0')
+from gi.repository import Modulemd  # noqa: E402
+
+from common import measure  # noqa: E402
+from modulemd_tools.repo2module.cli import (  # noqa: E402
+    DEFAULT_PROFILE, PackageInfo, RepoContent, create_module, get_source_packages)
+
+
+def synthetic_packages(count, versions):
+    """
+    Return `count` packages, where every name comes in `versions` versions
+    and every source package builds ten binary packages
+    """
+    packages = []
+    for i in range(count):
+        name = "pkg{0}".format(i // versions)
+        version = str(i % versions + 1)
+        sourcerpm = "src{0}-{1}-1.fc33.src.rpm".format(i // (versions * 10), version)
+        packages.append(PackageInfo(name, "x86_64", "0", version, "1.fc33", sourcerpm))
+    return packages
+
+
+def per_package(packages):
+    stream = Modulemd.ModuleStreamV2.new("bench", "rolling")
+    for srcpkg in get_source_packages(packages):
+        component = Modulemd.ComponentRpm.new(srcpkg)
+        component.set_rationale('Present in the repository')
+        stream.add_component(component)
+
+    common_profile = Modulemd.Profile.new(DEFAULT_PROFILE)
+    for pkg in packages:
+        stream.add_rpm_artifact(pkg.nevra())
+        stream.add_rpm_api(pkg.name)
+        common_profile.add_rpm(pkg.name)
+    stream.add_profile(common_profile)
+    return stream
+
+
+def bulk(packages):
+    content = RepoContent()
+    for pkg in packages:
+        content.add_package(pkg)
+    stream, _ = create_module("bench", "rolling", 1, "abcdef12", content)
+    return stream
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packages", type=int, default=50000)
+    parser.add_argument("--versions", type=int, default=3,
+                        help="How many versions of each package name there are")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    packages = synthetic_packages(args.packages, args.versions)
+    for label, func in [("per package", per_package), ("bulk", bulk)]:
+        elapsed, _ = measure(lambda: func(packages), args.repeat)
+        print("{0:<12} {1:>8.3f}s  {2:>8.2f}us per package".format(
+            label, elapsed, elapsed / len(packages) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
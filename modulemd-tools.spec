@@ -21,10 +21,10 @@ BuildRequires: python3-createrepo_c
 BuildRequires: python3-pyyaml
 BuildRequires: python3-pytest
 BuildRequires: python3-koji
+Recommends: python3-inotify_simple
 
 Requires: createrepo_c
-Requires: python3-dnf
-Requires: python3-hawkey
+Requires: python3-rpm
 Requires: python3-createrepo_c
 Requires: python3-pyyaml
 Requires: python3-libmodulemd >= 2.9.3
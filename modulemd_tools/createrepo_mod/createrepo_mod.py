@@ -17,9 +17,22 @@ https://docs.fedoraproject.org/en-US/modularity/hosting-modules/
 
 
 import argparse
+import fnmatch
+import functools
+import hashlib
 import os
+import re
+import shutil
 import subprocess
 import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
 
 # python3-packaging in not available in RHEL 8.x
 try:
@@ -27,9 +40,35 @@ try:
 except ModuleNotFoundError:
     from distutils.version import LooseVersion as Version
 
+import createrepo_c as cr
 import gi
 gi.require_version("Modulemd", "2.0")
-from gi.repository import Modulemd  # noqa: E402
+from gi.repository import GLib, Modulemd  # noqa: E402
+
+from modulemd_tools.modulemd_merge.modulemd_merge import write_index  # noqa: E402
+from modulemd_tools.scandir import iter_files  # noqa: E402
+
+
+ENGINES = ["subprocess", "library"]
+
+if inotify_simple:
+    WATCH_FLAGS = (inotify_simple.flags.CREATE | inotify_simple.flags.DELETE
+                   | inotify_simple.flags.CLOSE_WRITE | inotify_simple.flags.MOVED_FROM
+                   | inotify_simple.flags.MOVED_TO | inotify_simple.flags.ATTRIB)
+
+# Never search for module YAML files in these directories
+DEFAULT_SCAN_EXCLUDES = ["repodata", ".repodata", ".git"]
+
+FINGERPRINT_FILENAME = "createrepo_mod-fingerprint"
+
+COMPRESS_TYPES = ["gz", "bz2", "xz", "zstd"]
+
+# Compressors capable of multi-threaded encoding, `{0}` is the number of
+# threads (`0` meaning one thread per CPU core)
+PARALLEL_COMPRESSORS = {
+    "xz": (["xz", "-q", "-c", "-T{0}"], ".xz"),
+    "zstd": (["zstd", "-q", "-c", "-T{0}"], ".zst"),
+}
 
 
 def run_createrepo(args):
@@ -38,36 +77,221 @@ def run_createrepo(args):
     return proc.returncode
 
 
-def run_modifyrepo(path, compress_type=None):
+def run_modifyrepo(path, compress_type=None, threads=1, modules_yaml=None):
+    filename = modules_yaml or os.path.join(path, "modules.yaml")
+    precompressed = compress_type in PARALLEL_COMPRESSORS and threads != 1
+    if precompressed:
+        filename = compress_file_parallel(filename, compress_type, threads)
+
     cmd = [
         "modifyrepo_c",
         "--mdtype", "modules",
-        os.path.join(path, "modules.yaml"),
+        filename,
         os.path.join(path, "repodata"),
     ]
 
-    if compress_type:
+    if precompressed:
+        cmd.append("--no-compress")
+    elif compress_type:
         cmd.extend(["--compress-type", compress_type])
 
-    proc = subprocess.run(cmd, check=True)
+    try:
+        proc = subprocess.run(cmd, check=True)
+    finally:
+        # modifyrepo_c copies the file into repodata, it must not be
+        # published in the repository root
+        if precompressed:
+            os.remove(filename)
     return proc.returncode
 
 
-def find_module_yamls(path):
+def compress_file_parallel(path, compress_type, threads=0):
     """
-    Recursivelly find modulemd YAML files and return a list of their relative
-    paths.
+    Compress a file using a multi-threaded `xz` or `zstd` and return the path
+    of the compressed file. The original file is kept.
     """
-    matches = []
+    cmd, suffix = PARALLEL_COMPRESSORS[compress_type]
+    cmd = [arg.format(threads) for arg in cmd] + [path]
+    with open(path + suffix, "wb") as f:
+        subprocess.run(cmd, stdout=f, check=True)
+    return path + suffix
+
+
+def find_rpms(path):
+    """
+    Recursively find RPM packages in `path` and return a list of their paths
+    relative to `path`
+    """
+    rpms = []
     for root, dirnames, filenames in os.walk(path):
+        dirnames[:] = [d for d in dirnames if d not in ("repodata", ".repodata")]
         for filename in filenames:
-            if not filename.endswith((".yaml", ".yaml.gz")):
-                continue
-            filepath = os.path.join(root, filename)
-            if not is_yaml_valid_modulemd(filepath):
-                continue
-            matches.append(filepath)
-    return matches
+            if filename.endswith(".rpm"):
+                rpms.append(os.path.relpath(os.path.join(root, filename), path))
+    return sorted(rpms)
+
+
+def createrepo_library(path, progresscb=None, package_cache=None):
+    """
+    Generate repodata for all RPM packages within `path` directly through the
+    `createrepo_c` Python bindings, instead of spawning a `createrepo_c`
+    process. Only the primary, filelists and other metadata are generated
+    (no sqlite databases).
+
+    The optional `progresscb(done, total)` callback is called after each
+    processed package. Errors are raised as `createrepo_c.CreaterepoCError`.
+
+    When a `package_cache` dict is passed, the loaded packages are stored in
+    it and reused by the following calls, unless the RPM file changes.
+    """
+    rpms = find_rpms(path)
+    if package_cache is not None:
+        for relpath in set(package_cache) - set(rpms):
+            del package_cache[relpath]
+    tmp_repodata = os.path.join(path, ".repodata")
+    repodata = os.path.join(path, "repodata")
+    shutil.rmtree(tmp_repodata, ignore_errors=True)
+    os.mkdir(tmp_repodata)
+
+    files = [
+        ("primary", cr.PrimaryXmlFile),
+        ("filelists", cr.FilelistsXmlFile),
+        ("other", cr.OtherXmlFile),
+    ]
+    writers = []
+    for mdtype, xmlfile in files:
+        filename = os.path.join(tmp_repodata, "{0}.xml.gz".format(mdtype))
+        writer = xmlfile(filename)
+        writer.set_num_of_pkgs(len(rpms))
+        writers.append((mdtype, filename, writer))
+
+    for i, relpath in enumerate(rpms, start=1):
+        filepath = os.path.join(path, relpath)
+        stat = os.stat(filepath)
+        key = (stat.st_size, stat.st_mtime_ns)
+        cached = package_cache.get(relpath) if package_cache is not None else None
+        if cached and cached[0] == key:
+            pkg = cached[1]
+        else:
+            pkg = cr.package_from_rpm(filepath, cr.SHA256, location_href=relpath)
+        if package_cache is not None:
+            package_cache[relpath] = (key, pkg)
+        for _, _, writer in writers:
+            writer.add_pkg(pkg)
+        if progresscb:
+            progresscb(i, len(rpms))
+
+    repomd = cr.Repomd()
+    for mdtype, filename, writer in writers:
+        writer.close()
+        record = cr.RepomdRecord(mdtype, filename)
+        record.fill(cr.SHA256)
+        record.rename_file()
+        repomd.set_record(record)
+
+    with open(os.path.join(tmp_repodata, "repomd.xml"), "w") as f:
+        f.write(repomd.xml_dump())
+
+    shutil.rmtree(repodata, ignore_errors=True)
+    os.rename(tmp_repodata, repodata)
+    return 0
+
+
+def modifyrepo_library(path, compress_type=None, threads=1, modules_yaml=None):
+    """
+    Add the `modules.yaml` file from `path` (or the `modules_yaml` file) into
+    already existing repodata as a `modules` record, directly through the
+    `createrepo_c` Python bindings
+    """
+    modules_yaml = modules_yaml or os.path.join(path, "modules.yaml")
+    repodata = os.path.join(path, "repodata")
+    repomd_path = os.path.join(repodata, "repomd.xml")
+    repomd = cr.Repomd(repomd_path)
+
+    if compress_type in PARALLEL_COMPRESSORS and threads != 1:
+        compressed = compress_file_parallel(modules_yaml, compress_type, threads)
+        filename = os.path.join(repodata, os.path.basename(compressed))
+        shutil.move(compressed, filename)
+    else:
+        compression = cr.NO_COMPRESSION
+        if compress_type:
+            compression = cr.compression_type(compress_type)
+        suffix = cr.compression_suffix(compression) or ""
+        filename = os.path.join(repodata, "modules.yaml" + suffix)
+        cr.compress_file(modules_yaml, filename, compression)
+
+    if "modules" in repomd:
+        old = os.path.join(path, repomd["modules"].location_href)
+        if os.path.isfile(old):
+            os.remove(old)
+
+    record = cr.RepomdRecord("modules", filename)
+    record.fill(cr.SHA256)
+    record.rename_file()
+    repomd.set_record(record)
+
+    with open(repomd_path, "w") as f:
+        f.write(repomd.xml_dump())
+    return 0
+
+
+def _compile_globs(patterns):
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(p) for p in patterns))
+
+
+def _exclude_matcher(path, excludes):
+    # Globs containing a slash are matched against paths relative to `path`,
+    # the rest only against names, which is cheaper
+    name_re = _compile_globs([p for p in excludes if "/" not in p])
+    path_re = _compile_globs([p for p in excludes if "/" in p])
+
+    def excluded(name, filepath):
+        if name_re and name_re.match(name):
+            return True
+        return bool(path_re and path_re.match(os.path.relpath(filepath, path)))
+    return excluded
+
+
+def scan_directory(path, suffixes, workers=1, max_depth=None, excludes=None):
+    """
+    Recursively find files ending with one of the `suffixes` within `path`
+    and return a sorted list of their paths.
+
+    See `modulemd_tools.scandir.iter_files` for the meaning of `workers` and
+    `max_depth`. Files and directories which name or path relative to `path`
+    match any of the `excludes` globs are skipped.
+    """
+    excluded = _exclude_matcher(path, excludes or [])
+
+    def exclude(entry):
+        return excluded(entry.name, entry.path)
+
+    def match(entry):
+        return entry.name.endswith(suffixes)
+
+    return sorted(iter_files(path, match, workers=workers, max_depth=max_depth,
+                             exclude=exclude))
+
+
+def find_module_yamls(path, workers=1, max_depth=None, excludes=None):
+    """
+    Recursivelly find modulemd YAML files and return a list of their relative
+    paths.
+
+    See `scan_directory` for the meaning of `workers`, `max_depth` and
+    `excludes`. The found YAML files are validated in parallel as well.
+    """
+    if excludes is None:
+        excludes = DEFAULT_SCAN_EXCLUDES
+    candidates = scan_directory(path, (".yaml", ".yaml.gz"), workers,
+                                max_depth, excludes)
+    if workers == 1:
+        return [filepath for filepath in candidates if is_yaml_valid_modulemd(filepath)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        valid = executor.map(is_yaml_valid_modulemd, candidates)
+        return [filepath for filepath, ok in zip(candidates, valid) if ok]
 
 
 def is_yaml_valid_modulemd(path):
@@ -79,6 +303,16 @@ def is_yaml_valid_modulemd(path):
         modulemd-validator -q foo.yaml
 
     """
+    stat = os.stat(path)
+    return _is_yaml_valid_modulemd(os.path.realpath(path), stat.st_size,
+                                   stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=None)
+def _is_yaml_valid_modulemd(path, size, mtime):
+    # The results are shared among all repositories processed within one
+    # `createrepo_mod` run. The `size` and `mtime` are part of the cache key
+    # so a modified file is validated again.
     idx = Modulemd.ModuleIndex.new()
     (ret, _) = idx.update_from_file(path, strict=True)
     return ret
@@ -96,6 +330,48 @@ def dump_modules_yaml(path, yamls):
     subprocess.run(cmd)
 
 
+def merge_modules_yaml(path, yamls):
+    """
+    Same as `dump_modules_yaml` but merge the module YAMLs in-process
+    instead of spawning `modulemd-merge`
+    """
+    write_merged_modules_yaml(path, _read_indexes(yamls))
+
+
+def _read_indexes(yamls):
+    for yaml in yamls:
+        index = Modulemd.ModuleIndex.new()
+        ret, _ = index.update_from_file(yaml, True)
+        if ret:
+            yield index
+
+
+def _resolve_indexes(indexes):
+    # Nothing but the merged index is referenced once this returns, so the
+    # input indexes (unless the caller keeps them) are freed before the
+    # merged one is serialized
+    merger = Modulemd.ModuleIndexMerger.new()
+    for index in indexes:
+        merger.associate_index(index, 0)
+    return merger.resolve()
+
+
+def write_merged_modules_yaml(path, indexes):
+    """
+    Merge already parsed `Modulemd.ModuleIndex` objects and store the output
+    as modules.yaml file in the `path` directory. The `indexes` may be an
+    iterator, so they don't have to be all parsed before merging.
+    """
+    merged_index = _resolve_indexes(indexes)
+    del indexes
+
+    # The documents are written one by one to avoid holding the whole
+    # serialized modules.yaml in memory
+    with open(os.path.join(path, "modules.yaml"), "w") as f:
+        write_index(merged_index, f)
+
+
+@functools.lru_cache(maxsize=None)
 def createrepo_c_with_builtin_module_support():
     """
     There is a built-in support for module metadata in createrepo_c since
@@ -107,18 +383,490 @@ def createrepo_c_with_builtin_module_support():
     return Version(createrepo_c_version) >= Version("0.16.1")
 
 
-def main():
-    run_createrepo(sys.argv[1:])
-    if createrepo_c_with_builtin_module_support():
+def needs_modules_step(compress_type="gz", compress_threads=1, scan_options=None):
+    """
+    Determine whether modules.yaml has to be generated by `createrepo_mod`
+    even though `createrepo_c` has a built-in support for module metadata.
+    That is the case when any of the options affecting modules.yaml, which
+    `createrepo_c` doesn't know about, is used.
+    """
+    scan_options = scan_options or {}
+    excludes = scan_options.get("excludes")
+    return (compress_type != "gz" or compress_threads != 1
+            or scan_options.get("max_depth") is not None
+            or (excludes is not None and excludes != DEFAULT_SCAN_EXCLUDES))
+
+
+class ModulesYamlCache(object):
+    """
+    Keep parsed module YAML files of a repository in memory, so only the
+    changed ones need to be parsed again when re-generating modules.yaml
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.indexes = {}
+
+    def update(self, relpaths):
+        """
+        Parse again (or forget, when removed) the specified module YAML files
+        """
+        for relpath in relpaths:
+            self.indexes.pop(relpath, None)
+            filepath = os.path.join(self.path, relpath)
+            if not os.path.isfile(filepath):
+                continue
+            index = Modulemd.ModuleIndex.new()
+            ret, _ = index.update_from_file(filepath, True)
+            if ret:
+                self.indexes[relpath] = index
+
+    def dump(self, directory):
+        """
+        Merge all the module YAML files into modules.yaml in the `directory`
+        """
+        # The parsed indexes are kept by the cache, so unlike
+        # `merge_modules_yaml` they stay in memory while writing
+        write_merged_modules_yaml(
+            directory, (self.indexes[relpath] for relpath in sorted(self.indexes)))
+
+
+class DirectoryWatcher(object):
+    """
+    Wait for changes of RPM packages and module YAML files within a directory
+    tree. The inotify is used when the `inotify_simple` module is available,
+    otherwise the directory is periodically polled.
+
+    Module YAML files are looked for the same way `find_module_yamls` does,
+    i.e. the `excludes` and `max_depth` apply to them. RPM packages are
+    watched in the whole tree except for the `DEFAULT_SCAN_EXCLUDES`
+    directories.
+    """
+
+    def __init__(self, path, debounce=2.0, excludes=None, max_depth=None):
+        self.path = path
+        self.debounce = debounce
+        self.excluded = _exclude_matcher(
+            path, DEFAULT_SCAN_EXCLUDES if excludes is None else excludes)
+        self.max_depth = max_depth
+        self.inotify = inotify_simple.INotify() if inotify_simple else None
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self):
+        """
+        Return a dict of RPM packages and module YAML files (their paths
+        relative to the watched directory) and their sizes and mtimes
+        """
+        snapshot = {}
+        # Directories in which module YAML files are not looked for
+        no_yamls = set()
+        for root, dirnames, filenames in os.walk(self.path):
+            dirnames[:] = [d for d in dirnames if d not in DEFAULT_SCAN_EXCLUDES]
+            if self.inotify:
+                self.inotify.add_watch(root, WATCH_FLAGS)
+
+            relroot = os.path.relpath(root, self.path)
+            depth = 0 if relroot == os.curdir else relroot.count(os.sep) + 1
+            yamls = (root not in no_yamls
+                     and (self.max_depth is None or depth <= self.max_depth))
+            for dirname in dirnames:
+                dirpath = os.path.join(root, dirname)
+                if not yamls or self.excluded(dirname, dirpath):
+                    no_yamls.add(dirpath)
+
+            for filename in filenames:
+                filepath = os.path.join(root, filename)
+                if not filename.endswith(".rpm"):
+                    if not yamls or not filename.endswith((".yaml", ".yaml.gz")):
+                        continue
+                    if self.excluded(filename, filepath):
+                        continue
+                relpath = os.path.relpath(filepath, self.path)
+                try:
+                    stat = os.stat(filepath)
+                except FileNotFoundError:
+                    continue
+                snapshot[relpath] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def wait(self):
+        """
+        Block until some files are changed and then there are no other
+        changes for `debounce` seconds. Return a set of changed files.
+        """
+        while True:
+            if self.inotify:
+                self.inotify.read()
+                while self.inotify.read(timeout=int(self.debounce * 1000)):
+                    pass
+                snapshot = self.take_snapshot()
+            else:
+                time.sleep(self.debounce)
+                snapshot = self.take_snapshot()
+                if snapshot == self.snapshot:
+                    continue
+                while True:
+                    time.sleep(self.debounce)
+                    previous, snapshot = snapshot, self.take_snapshot()
+                    if snapshot == previous:
+                        break
+
+            changed = {relpath for relpath in set(self.snapshot) | set(snapshot)
+                       if self.snapshot.get(relpath) != snapshot.get(relpath)}
+            self.snapshot = snapshot
+            if changed:
+                return changed
+
+
+def watch_repository(path, debounce=2.0, engine="subprocess",
+                     createrepo_args=None, compress_type="gz",
+                     compress_threads=1, scan_options=None):
+    """
+    Generate module repository metadata for a directory `path` and keep them
+    up-to-date with its content until interrupted. Only the affected parts
+    are updated, i.e. packages metadata when RPM packages change, and
+    modules.yaml when module YAML files change (only the changed YAML files
+    are parsed again).
+
+    Unlike `generate_repository`, the merged modules.yaml is kept outside of
+    `path`, so it is not mistaken for a changed input. A modules.yaml file
+    within `path` is an input as any other module YAML file.
+
+    The `scan_options` are the same as for `generate_repository`, except for
+    `workers`, which is not used. A failed update is reported and the whole
+    repository metadata are generated again after the next change.
+    """
+    createrepo_args = createrepo_args or []
+    scan_options = scan_options or {}
+    if "--update" not in createrepo_args:
+        createrepo_args = createrepo_args + ["--update"]
+    builtin = (engine == "subprocess" and createrepo_c_with_builtin_module_support()
+               and not needs_modules_step(compress_type, compress_threads, scan_options))
+
+    watcher = DirectoryWatcher(path, debounce, scan_options.get("excludes"),
+                               scan_options.get("max_depth"))
+    modules = ModulesYamlCache(path)
+    package_cache = {}
+    workdir = tempfile.mkdtemp(prefix="createrepo_mod-")
+    modules_yaml = os.path.join(workdir, "modules.yaml")
+
+    def update_packages():
+        if engine == "library":
+            createrepo_library(path, package_cache=package_cache)
+        else:
+            run_createrepo([path] + createrepo_args)
+
+    def update_modules():
+        modules.dump(workdir)
+        if engine == "library":
+            modifyrepo_library(path, compress_type, compress_threads, modules_yaml)
+        else:
+            run_modifyrepo(path, compress_type, compress_threads, modules_yaml)
+
+    def update_all():
+        update_packages()
+        if not builtin:
+            modules.indexes.clear()
+            modules.update([relpath for relpath in watcher.snapshot
+                            if not relpath.endswith(".rpm")])
+            if modules.indexes:
+                update_modules()
+
+    def update_changed(changed):
+        rpms = {relpath for relpath in changed if relpath.endswith(".rpm")}
+        yamls = changed - rpms
+        print("Changed {0} RPM packages and {1} YAML files in {2}".format(
+            len(rpms), len(yamls), path))
+
+        if builtin:
+            update_packages()
+            return
+
+        modules.update(yamls)
+        # Regenerating the packages metadata also drops a no longer
+        # valid `modules` record
+        if rpms or (yamls and not modules.indexes):
+            update_packages()
+        if modules.indexes:
+            update_modules()
+
+    def run(update, *args):
+        try:
+            update(*args)
+            return True
+        except (subprocess.CalledProcessError, cr.CreaterepoCError, OSError,
+                GLib.Error) as ex:
+            sys.stderr.write("Error: Failed to update {0}, waiting for the "
+                             "next change: {1}\n".format(path, str(ex)))
+            return False
+
+    try:
+        updated = run(update_all)
+        while True:
+            changed = watcher.wait()
+            if updated:
+                updated = run(update_changed, changed)
+            else:
+                updated = run(update_all)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def generate_repository(path, engine="subprocess", createrepo_args=None,
+                        compress_type="gz", compress_threads=1,
+                        scan_options=None):
+    """
+    Generate module repository metadata for a directory `path`. The
+    `scan_options` are passed to `find_module_yamls`.
+    """
+    createrepo_args = createrepo_args or []
+    scan_options = scan_options or {}
+
+    if engine == "library":
+        createrepo_library(path)
+        yamls = find_module_yamls(path, **scan_options)
+        if not yamls:
+            return
+        merge_modules_yaml(path, yamls)
+        modifyrepo_library(path, compress_type, compress_threads)
         return
 
-    parser = get_arg_parser()
-    args, _ = parser.parse_known_args()
-    yamls = find_module_yamls(args.path)
+    run_createrepo([path] + createrepo_args)
+    # The `modules` record added by createrepo_c is replaced by modifyrepo_c
+    if (createrepo_c_with_builtin_module_support()
+            and not needs_modules_step(compress_type, compress_threads, scan_options)):
+        return
+
+    yamls = find_module_yamls(path, **scan_options)
     if not yamls:
         return
-    dump_modules_yaml(args.path, yamls)
-    run_modifyrepo(args.path, "gz")
+    dump_modules_yaml(path, yamls)
+    run_modifyrepo(path, compress_type, compress_threads)
+
+
+def compute_fingerprint(path, settings=None):
+    """
+    Return a hash of the list of files within `path` (except for repodata and
+    the generated modules.yaml), their sizes and modification times, and any
+    additional `settings` strings affecting the generated metadata.
+    The files are not read, the directory tree is traversed in a single pass.
+
+    Symlinks are followed, so a changed target of a symlinked package is
+    noticed. Dangling symlinks are recorded with the path they point to.
+    """
+    fingerprint = hashlib.sha256()
+    for setting in settings or []:
+        fingerprint.update(setting.encode("utf-8") + b"\0")
+
+    for root, dirnames, filenames in os.walk(path):
+        dirnames[:] = sorted(d for d in dirnames if d not in ("repodata", ".repodata"))
+        for filename in sorted(filenames):
+            filepath = os.path.join(root, filename)
+            relpath = os.path.relpath(filepath, path)
+            # The generated modules.yaml, possibly compressed
+            if relpath == "modules.yaml" or relpath.startswith("modules.yaml."):
+                continue
+            try:
+                stat = os.stat(filepath)
+                entry = "{0}\0{1}\0{2}\n".format(relpath, stat.st_size,
+                                                 stat.st_mtime_ns)
+            except FileNotFoundError:
+                # Removed in the meantime
+                if not os.path.islink(filepath):
+                    continue
+                entry = "{0}\0dangling\0{1}\n".format(relpath, os.readlink(filepath))
+            fingerprint.update(entry.encode("utf-8", "surrogateescape"))
+    return fingerprint.hexdigest()
+
+
+def read_fingerprint(path):
+    """
+    Return the fingerprint stored by the last `createrepo_mod` run for `path`
+    or `None` if there are no repository metadata
+    """
+    if not os.path.isfile(os.path.join(path, "repodata", "repomd.xml")):
+        return None
+    try:
+        with open(os.path.join(path, "repodata", FINGERPRINT_FILENAME), "r") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def write_fingerprint(path, fingerprint):
+    """
+    Store the fingerprint next to the repomd.xml file
+    """
+    with open(os.path.join(path, "repodata", FINGERPRINT_FILENAME), "w") as f:
+        f.write(fingerprint + "\n")
+
+
+def process_repository(path, engine="subprocess", createrepo_args=None,
+                       compress_type="gz", compress_threads=1,
+                       skip_unchanged=False, scan_options=None):
+    """
+    Generate module repository metadata for a directory `path`. With
+    `skip_unchanged`, nothing is done when no file in the directory changed
+    since the last run.
+    """
+    createrepo_args = createrepo_args or []
+
+    if skip_unchanged:
+        settings = [engine, compress_type, str(compress_threads)] + createrepo_args
+        # The number of scan workers doesn't affect which YAMLs are found
+        for key, value in sorted((scan_options or {}).items()):
+            if key != "workers":
+                settings.append("{0}={1}".format(key, value))
+        fingerprint = compute_fingerprint(path, settings)
+        if fingerprint == read_fingerprint(path):
+            print("Skipping {0}, nothing changed since the last run".format(path))
+            return
+
+    generate_repository(path, engine, createrepo_args, compress_type,
+                        compress_threads, scan_options)
+
+    if skip_unchanged:
+        write_fingerprint(path, fingerprint)
+
+
+def process_repositories(paths, workers=1, **kwargs):
+    """
+    Run `process_repository` for each of the `paths` within a pool of
+    `workers` threads. Return a list of `(path, error, seconds)` tuples in the
+    same order as `paths`, `error` is `None` for successfully processed
+    repositories.
+    """
+    def _process(path):
+        start = time.time()
+        try:
+            process_repository(path, **kwargs)
+            error = None
+        except (subprocess.CalledProcessError, cr.CreaterepoCError, OSError,
+                GLib.Error) as ex:
+            error = ex
+        return path, error, time.time() - start
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_process, paths))
+
+
+def read_batch_file(path):
+    """
+    Parse a text file containing a list of directories to index, one per line.
+    Empty lines and lines starting with `#` are ignored.
+    """
+    with open(path, "r") as f:
+        lines = [line.strip() for line in f]
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def split_arguments(parser, argv):
+    """
+    Split the command-line arguments into the ones defined by `parser` and
+    the rest, which is passed to `createrepo_c` unchanged. Only the options
+    known to `parser` are picked; any positional argument stays in the rest.
+    """
+    own, rest = [], []
+    argv = iter(argv)
+    for arg in argv:
+        if arg == "--":
+            rest.extend(argv)
+            break
+        option = arg.split("=", 1)[0]
+        action = parser._option_string_actions.get(option)
+        if not action:
+            rest.append(arg)
+            continue
+        own.append(arg)
+        if action.nargs != 0 and "=" not in arg:
+            value = next(argv, None)
+            if value is not None:
+                own.append(value)
+    return own, rest
+
+
+def parse_arguments(argv=None):
+    """
+    Parse the `createrepo_mod` command-line arguments. Return the parsed
+    arguments and a list of arguments for `createrepo_c`.
+
+    We don't know which `createrepo_c` options take a value, so the
+    directory to index has to be either the first or the last argument
+    (not counting the `createrepo_mod` options). Multiple directories can
+    be specified only at the beginning, before any `createrepo_c` option.
+    With `--batch`, only the directories at the beginning are accepted.
+    """
+    parser = get_arg_parser()
+    own, rest = split_arguments(parser, sys.argv[1:] if argv is None else argv)
+    args = parser.parse_args(own)
+
+    leading = 0
+    while leading < len(rest) and not rest[leading].startswith("-"):
+        leading += 1
+
+    if leading or args.batch:
+        args.path, createrepo_args = rest[:leading], rest[leading:]
+    elif rest and not rest[-1].startswith("-"):
+        args.path, createrepo_args = rest[-1:], rest[:-1]
+    elif rest:
+        parser.error("directory_to_index has to be either the first or the "
+                     "last argument")
+    else:
+        args.path, createrepo_args = [], rest
+    return parser, args, createrepo_args
+
+
+def main():
+    parser, args, createrepo_args = parse_arguments()
+
+    if args.engine == "library" and createrepo_args:
+        parser.error("createrepo_c options are not supported by the library "
+                     "engine: {0}".format(" ".join(createrepo_args)))
+
+    paths = list(args.path)
+    if args.batch:
+        paths.extend(read_batch_file(args.batch))
+    if not paths:
+        parser.error("At least one directory_to_index or --batch is required")
+
+    kwargs = {
+        "engine": args.engine,
+        "createrepo_args": createrepo_args,
+        "compress_type": args.modules_compress_type,
+        "compress_threads": args.modules_compress_threads,
+        "scan_options": {
+            "workers": args.scan_workers,
+            "max_depth": args.scan_depth,
+            "excludes": DEFAULT_SCAN_EXCLUDES + (args.scan_exclude or []),
+        },
+    }
+    if args.watch:
+        if len(paths) != 1:
+            parser.error("--watch works only with a single directory_to_index")
+        if args.skip_unchanged:
+            parser.error("--skip-unchanged cannot be used with --watch")
+        try:
+            watch_repository(paths[0], debounce=args.watch_debounce, **kwargs)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    kwargs["skip_unchanged"] = args.skip_unchanged
+    if len(paths) == 1:
+        process_repository(paths[0], **kwargs)
+        return
+
+    results = process_repositories(paths, workers=args.batch_workers, **kwargs)
+    failed = 0
+    for path, error, seconds in results:
+        if error:
+            failed += 1
+            print("FAILED {0} ({1:.2f}s): {2}".format(path, seconds, error))
+        else:
+            print("OK     {0} ({1:.2f}s)".format(path, seconds))
+    print("Processed {0} repositories, {1} failed".format(len(results), failed))
+    if failed:
+        sys.exit(1)
 
 
 def get_arg_parser():
@@ -130,15 +878,62 @@ def get_arg_parser():
 
     description = ("A small wrapper around createrepo_c and modifyrepo_c to"
                    "provide an easy tool for generating module repositories")
-    parser = argparse.ArgumentParser("createrepo_mod", description=description)
-    parser.add_argument("path", metavar="directory_to_index",
-                        help="Directory to index")
+    parser = argparse.ArgumentParser("createrepo_mod", description=description,
+                                     allow_abbrev=False)
+    parser.add_argument("path", metavar="directory_to_index", nargs="*",
+                        help=("Directory to index. Multiple directories can be "
+                              "specified, each of them is indexed separately"))
+    parser.add_argument("--batch", metavar="FILE",
+                        help=("Text file containing a list of directories to "
+                              "index, one per line"))
+    parser.add_argument("--batch-workers", type=int, default=1,
+                        help=("Number of repositories processed in parallel "
+                              "when indexing multiple directories"))
+    parser.add_argument("--engine", choices=ENGINES, default="subprocess",
+                        help=("Generate the repodata by spawning createrepo_c "
+                              "and modifyrepo_c processes (default), or "
+                              "in-process through the createrepo_c Python "
+                              "bindings. The library engine doesn't accept "
+                              "any createrepo_c options"))
+    parser.add_argument("--modules-compress-type", choices=COMPRESS_TYPES,
+                        default="gz",
+                        help="Compression used for modules.yaml (default: gz)")
+    parser.add_argument("--modules-compress-threads", type=int, default=1,
+                        help=("Number of threads used for compressing "
+                              "modules.yaml with xz or zstd, 0 means one per "
+                              "CPU core (default: 1)"))
+    parser.add_argument("--scan-workers", type=int, default=1,
+                        help=("Number of threads searching for module YAML "
+                              "files, useful on network filesystems "
+                              "(default: 1)"))
+    parser.add_argument("--scan-depth", type=int, metavar="DEPTH",
+                        help=("Search for module YAML files only up to this "
+                              "many subdirectories deep (default: unlimited)"))
+    parser.add_argument("--scan-exclude", action="append", metavar="GLOB",
+                        help=("Don't search for module YAML files in "
+                              "directories and files matching this glob. "
+                              "For multiple globs, repeat this option. "
+                              "Always excluded: {0}".format(
+                                  ", ".join(DEFAULT_SCAN_EXCLUDES))))
+    parser.add_argument("--skip-unchanged", action="store_true",
+                        help=("Do nothing if no file in the directory changed "
+                              "since the last run (based on file names, sizes "
+                              "and modification times)"))
+    parser.add_argument("--watch", action="store_true",
+                        help=("Keep running and incrementally update the "
+                              "repository metadata whenever RPM packages or "
+                              "module YAML files change"))
+    parser.add_argument("--watch-debounce", type=float, default=2.0,
+                        metavar="SECONDS",
+                        help=("Wait until there are no changes for this many "
+                              "seconds before updating the repository "
+                              "(default: 2)"))
     return parser
 
 
 if __name__ == "__main__":
     try:
         main()
-    except subprocess.CalledProcessError as ex:
+    except (subprocess.CalledProcessError, cr.CreaterepoCError, GLib.Error) as ex:
         sys.stderr.write("Error: {0}\n".format(str(ex)))
         sys.exit(1)
@@ -6,19 +6,22 @@ and generate N:S:V:C:A.modulemd.yaml for them.
 """
 
 import argparse
-import fnmatch
+import glob
+import json
 import os
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import gi
-import hawkey
 import rpm
-from dnf.subject import Subject
 
 
 gi.require_version("Modulemd", "2.0")
 from gi.repository import Modulemd  # noqa: E402
 
+from modulemd_tools.scandir import iter_files  # noqa: E402
+
 
 class ModuleBase:
     """
@@ -74,19 +77,47 @@ class ModuleBase:
         with open(self.filename, "w") as moduleyaml:
             moduleyaml.write(self.dumps())
 
+    @property
+    def packages(self):
+        return self._packages
+
+    @packages.setter
+    def packages(self, packages):
+        # The sets derived from the previous packages are no longer valid.
+        # Modifying the list in place is not detected.
+        self._packages = packages
+        self._package_names = None
+        self._package_nevras = None
+
+    def _index_packages(self):
+        """
+        Compute all views of the packages in one pass over them
+        """
+        names = set()
+        nevras = set()
+        for package in self.packages:
+            names.add(package.name)
+            nevras.add(package.nevra)
+        self._package_names = names
+        self._package_nevras = nevras
+
     @property
     def package_names(self):
         """
         Return the list of unique package names within this module
         """
-        return {package.header.name for package in self.packages}
+        if self._package_names is None:
+            self._index_packages()
+        return self._package_names
 
     @property
     def package_nevras(self):
         """
         Return the list of unique package NEVRAs within this module
         """
-        return {package.nevra for package in self.packages}
+        if self._package_nevras is None:
+            self._index_packages()
+        return self._package_nevras
 
 
 class Module(ModuleBase):
@@ -157,75 +188,226 @@ class ModuleDefaults(ModuleBase):
 class Package(object):
     """
     Provide a high-level package interface for the needs of module generation
+
+    Only the few needed header fields are kept, not the whole header with
+    file lists, changelogs, etc. which would take a lot of memory for
+    thousands of packages.
     """
 
-    def __init__(self, path):
+    __slots__ = ["path", "name", "epoch", "version", "release", "arch",
+                 "nevra", "license", "modularitylabel"]
+
+    def __init__(self, path, header=None):
+        if header is None:
+            header = read_header(path)
         self.path = path
-        self.header = self._get_header()
+        self.name = header["name"]
+        self.epoch = header["epoch"]
+        self.version = header["version"]
+        self.release = header["release"]
+        self.arch = header["arch"]
+        self.nevra = get_nevra(header)
+        self.license = header["license"]
+        self.modularitylabel = header["modularitylabel"]
 
     @property
-    def nevra(self):
+    def has_modularity_label(self):
         """
-        Takes a package filename and returns its NEVRA
+        Examine a RPM package and see if it has `ModularityLabel` set in its header
         """
-        filename = os.path.basename(self.path)
-        if not filename.endswith(".rpm"):
-            raise ValueError("File name doesn't end with '.rpm': {}".format(self.path))
-
-        # @TODO: construct NEVRA from rpm header
-        subject = Subject(filename)
-        nevras = subject.get_nevra_possibilities(forms=[hawkey.FORM_NEVRA])
-        for nevra in nevras:
-            # For some reason `nevra.release` contains also the architecture
-            return "{N}-{E}:{V}-{RA}".format(N=nevra.name, E=nevra.epoch or 0,
-                                             V=nevra.version, RA=nevra.release)
+        return bool(self.modularitylabel)
+
+
+def get_nevra(header):
+    """
+    Construct a NEVRA from a RPM header
+    """
+    # Only binary packages have a source package
+    arch = header["arch"] if header["sourcerpm"] else "src"
+    return "{N}-{E}:{V}-{R}.{A}".format(
+        N=header["name"], E=header["epoch"] or 0, V=header["version"],
+        R=header["release"], A=arch)
+
+
+class HeaderReader(object):
+    """
+    Read RPM package headers. Initializing a `rpm.TransactionSet` loads the
+    rpm configuration and keyring, so instead of doing that for every
+    package, each thread creates one and then reuses it.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
 
     @property
-    def license(self):
+    def transaction_set(self):
+        """
+        The `rpm.TransactionSet` of the current thread
         """
-        Examine a RPM package and return its license
+        ts = getattr(self._local, "ts", None)
+        if ts is None:
+            ts = rpm.TransactionSet()
+            ts.setKeyring(rpm.keyring())
+            ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES | rpm._RPMVSF_NODIGESTS)
+            self._local.ts = ts
+        return ts
+
+    def read(self, path):
         """
-        return self.header["license"]
+        Examine a RPM package file and return its header
+        See docs.fedoraproject.org/en-US/Fedora_Draft_Documentation/0.1/html/RPM_Guide/ch16s04.html
+        """
+        with open(path, "r") as f:
+            return self.transaction_set.hdrFromFdno(f.fileno())
 
-    @property
-    def has_modularity_label(self):
+
+_header_reader = HeaderReader()
+
+
+def read_header(path):
+    """
+    Examine a RPM package file and return its header
+    """
+    return _header_reader.read(path)
+
+
+class HeaderCache(object):
+    """
+    Persistent cache of the RPM header fields needed for generating a
+    module, stored in a JSON file. Entries are keyed by the package path and
+    invalidated when its size, modification time or inode changes, so
+    reading an unchanged package costs only a `stat`.
+    """
+
+    # Header fields that are stored in the cache
+    FIELDS = ["name", "epoch", "version", "release", "arch", "sourcerpm",
+              "license", "modularitylabel"]
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r") as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+        except ValueError:
+            # A corrupted cache is only a slower cache
+            self.entries = {}
+
+    def read(self, path):
         """
-        Examine a RPM package and see if it has `ModularityLabel` set in its header
+        Return the cached header fields of a RPM package as a `dict`, which
+        can be used in place of its header. The header is read only if the
+        package changed since it was cached.
         """
-        return bool(self.header["modularitylabel"])
+        abspath = os.path.abspath(path)
+        stat = os.stat(abspath)
+        identity = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
 
-    def _get_header(self):
+        entry = self.entries.get(abspath)
+        if entry and entry["identity"] == identity:
+            return entry["header"]
+
+        header = read_header(abspath)
+        fields = {field: header[field] for field in self.FIELDS}
+        with self._lock:
+            self.entries[abspath] = {"identity": identity, "header": fields}
+        return fields
+
+    def save(self):
         """
-        Examine a RPM package file and return its header
-        See docs.fedoraproject.org/en-US/Fedora_Draft_Documentation/0.1/html/RPM_Guide/ch16s04.html
+        Write the cache, forgetting packages that no longer exist
         """
-        ts = rpm.TransactionSet()
-        ts.setKeyring(rpm.keyring())
-        ts.setVSFlags(rpm._RPMVSF_NOSIGNATURES | rpm._RPMVSF_NODIGESTS)
-        with open(self.path, "r") as f:
-            hdr = ts.hdrFromFdno(f.fileno())
-            return hdr
+        entries = {path: entry for path, entry in self.entries.items()
+                   if os.path.exists(path)}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp, self.path)
 
 
-def find_packages(path):
+def load_packages(paths, workers=1, cache=None):
+    """
+    Read headers of RPM packages and return a list of `Package` objects in
+    the same order as `paths`. Reading headers is mostly waiting for I/O
+    (and rpm releases the GIL meanwhile), so on network storage it pays off
+    to read them in multiple threads. The `paths` can be a generator, each
+    path is handed to a worker as soon as it is generated. If a
+    `HeaderCache` is given, headers of unchanged packages are taken from it.
+    """
+    read = cache.read if cache else read_header
+
+    def load(path):
+        return Package(path, read(path))
+
+    if workers == 1:
+        return [load(path) for path in paths]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(load, paths))
+
+
+def iter_packages(path, workers=1, followlinks=False):
+    """
+    Recursively find RPM packages in a `path` and return a generator
+    yielding them one by one, as the directories are traversed.
+
+    See `modulemd_tools.scandir.iter_files` for the meaning of `workers` and
+    `followlinks`.
+    """
+    if not os.path.isdir(path):
+        raise ValueError("Directory does not exist: {0}".format(path))
+
+    def match(entry):
+        return entry.name.endswith(".rpm") and not entry.name.endswith(".src.rpm")
+
+    return iter_files(path, match, workers=workers, followlinks=followlinks)
+
+
+def find_packages(path, workers=1, followlinks=False):
     """
     Recursively find RPM packages in a `path` and return their list
     """
-    packages = []
-    for root, _, filenames in os.walk(path):
-        for filename in fnmatch.filter(filenames, "*.rpm"):
-            if filename.endswith(".src.rpm"):
-                continue
-            packages.append(os.path.join(root, filename))
-    return packages
+    return list(iter_packages(path, workers=workers, followlinks=followlinks))
+
+
+def iter_packages_in_file(path):
+    """
+    Parse a text file containing a list of packages, or the standard input if
+    `path` is `-`, and yield the packages one by one. Blank lines are
+    skipped and glob patterns are expanded. A glob pattern matching no
+    package is an error.
+    """
+    if path == "-":
+        yield from _iter_pkglist(sys.stdin)
+        return
+
+    with open(path, "r") as pkglist:
+        yield from _iter_pkglist(pkglist)
+
+
+def _iter_pkglist(pkglist):
+    for line in pkglist:
+        line = line.strip()
+        if not line:
+            continue
+        # An existing file is never expanded, even if its name contains
+        # some of the glob characters
+        if not glob.has_magic(line) or os.path.lexists(line):
+            yield line
+            continue
+        paths = glob.glob(line)
+        if not paths:
+            raise ValueError("No packages match {0}".format(line))
+        yield from sorted(paths)
 
 
 def find_packages_in_file(path):
     """
     Parse a text file containing a list of packages and return their list
     """
-    with open(path, "r") as pkglist:
-        return pkglist.read().splitlines()
+    return list(iter_packages_in_file(path))
 
 
 def parse_nsvca(nsvca):
@@ -266,9 +448,23 @@ def get_arg_parser():
                         help=("By defult the output is saved in a file. Use "
                               "this to suppress it and print to the STDOUT"))
 
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help=("Number of threads finding RPM packages and "
+                              "reading their headers in parallel, useful for "
+                              "packages on network storage"))
+    parser.add_argument("--follow-symlinks", action="store_true",
+                        help="Follow symlinks to directories when using --dir")
+    parser.add_argument("--header-cache", metavar="FILE",
+                        help=("Cache the needed RPM header fields in this "
+                              "file, so only new or changed packages are "
+                              "read in the next run"))
+
     input_group = parser.add_mutually_exclusive_group(required=True)
     input_group.add_argument("--dir", help="")
-    input_group.add_argument("--pkglist", help="")
+    input_group.add_argument("--pkglist",
+                             help=("File with a list of packages, one per line, "
+                                   "which can contain glob patterns. Use - to "
+                                   "read the list from STDIN"))
     return parser
 
 
@@ -283,14 +479,20 @@ def main():
     args = parser.parse_args()
     name, stream, version, context, arch = parse_nsvca(args.nsvca)
 
+    # The paths are generated lazily, so the headers are read while the
+    # directory or package list is still being traversed
     if args.dir:
         path = os.path.expanduser(args.dir)
-        packages = find_packages(path)
+        packages = iter_packages(path, workers=args.workers,
+                                 followlinks=args.follow_symlinks)
     else:
         path = os.path.expanduser(args.pkglist)
-        packages = find_packages_in_file(path)
+        packages = iter_packages_in_file(path)
 
-    packages = [Package(package) for package in packages]
+    cache = HeaderCache(os.path.expanduser(args.header_cache)) if args.header_cache else None
+    packages = load_packages(packages, workers=args.workers, cache=cache)
+    if cache:
+        cache.save()
     licenses = {package.license for package in packages}
 
     requires = parse_dependencies(args.requires)
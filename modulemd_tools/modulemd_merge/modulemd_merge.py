@@ -105,6 +105,45 @@ def merge_file(merger, filename):
     merger.associate_index(index, 0)
 
 
+def _dump_document(add_method, document):
+    index = Modulemd.ModuleIndex.new()
+    getattr(index, add_method)(document)
+    return index.dump_to_string()
+
+
+def iter_index_documents(index):
+    """
+    Serialize a ModuleIndex one YAML document at a time, so the whole index
+    never needs to be held in memory as one string.
+    """
+    for modname in index.get_module_names():
+        module = index.get_module(modname)
+
+        defaults = module.get_defaults()
+        if defaults:
+            yield _dump_document("add_defaults", defaults)
+
+        for stream_name in module.get_stream_names():
+            translation = module.get_translation(stream_name)
+            if translation:
+                yield _dump_document("add_translation", translation)
+
+        for stream in module.get_all_streams():
+            yield _dump_document("add_module_stream", stream)
+
+        # Obsoletes are supported since libmodulemd 2.10
+        for obsoletes in getattr(module, "get_obsoletes", list)():
+            yield _dump_document("add_obsoletes", obsoletes)
+
+
+def write_index(index, output):
+    """
+    Write all documents of a ModuleIndex into the `output` file object
+    """
+    for document in iter_index_documents(index):
+        output.write(document)
+
+
 def get_arg_parser():
     description = "Merge several modules.yaml files (rpm modularity metadata) into one."
     parser = argparse.ArgumentParser("modulemd-merge", description=description,
@@ -150,6 +189,8 @@ def main():
         merge_input(args, merger, i)
 
     merged_index = merger.resolve()
+    # Free the input indexes before serializing the merged one
+    del merger
 
     modnames = merged_index.get_module_names()
     defstreams = merged_index.get_default_streams()
@@ -167,7 +208,7 @@ def main():
         logging.debug("Writing an empty YAML")
         output.write("")
     else:
-        output.write(merged_index.dump_to_string())
+        write_index(merged_index, output)
 
     if not args.to_stdout:
         output.close()
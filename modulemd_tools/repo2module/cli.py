@@ -3,11 +3,20 @@
 import argparse
 import createrepo_c as cr
 import gi
+import hashlib
+import json
 import logging
 import os
+import re
+import shutil
+import sqlite3
 import sys
-import hawkey
-from dnf.subject import Subject
+import tempfile
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
 
 gi.require_version('Modulemd', '2.0')
@@ -16,10 +25,41 @@ from gi.repository import Modulemd  # noqa: E402
 
 DEFAULT_PROFILE = 'everything'
 
+# The same pattern that libdnf uses for parsing the `hawkey.FORM_NEVRA` form
+NEVRA_RE = re.compile(
+    r"^([^:(/=<> ]+)-(([0-9]+):)?([^-:(/=<> ]+)-([^-:(/=<> ]+)\.([^-:.(/=<> ]+)$")
 
-def parse_repodata(path):
+
+DEFAULT_CACHEDIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "repo2module")
+
+
+class PackageInfo(namedtuple("PackageInfo", ["name", "arch", "epoch", "version",
+                                             "release", "rpm_sourcerpm"])):
+    """
+    The subset of `createrepo_c.Package` attributes needed for generating
+    a module
+    """
+    __slots__ = ()
+
+    def nevra(self):
+        return "{0}-{1}:{2}-{3}.{4}".format(self.name, self.epoch or "0",
+                                            self.version, self.release,
+                                            self.arch)
+
+
+def parse_repodata(path, pkgcb=None, fast=False):
     """
-    Return a list of packages included in this repository
+    Return a list of packages included in this repository.
+
+    When a `pkgcb` callback is specified, it is called for each package as
+    soon as it is parsed, and the packages are not retained (an empty list
+    is returned).
+
+    With `fast`, only the fields needed for generating a module are read
+    from the primary sqlite database, and packages are represented by
+    `PackageInfo` instead of `createrepo_c.Package`. Repositories without
+    the database are parsed as usual.
     """
     try:
         repomd = cr.Repomd(os.path.join(path, "repodata/repomd.xml"))
@@ -43,10 +83,14 @@ def parse_repodata(path):
 
     packages = []
 
-    def pkgcb(pkg):
+    def append_pkgcb(pkg):
         # Called when whole package entry in xml is parsed
         packages.append(pkg)
 
+    pkgcb = pkgcb or append_pkgcb
+    if fast and parse_primary_fast(path, repomd, pkgcb):
+        return packages
+
     cr.xml_parse_primary(os.path.join(path, primary_xml_path),
                          pkgcb=pkgcb,
                          do_files=False,
@@ -55,26 +99,490 @@ def parse_repodata(path):
     return packages
 
 
+def parse_primary_fast(path, repomd, pkgcb):
+    """
+    Call `pkgcb` with a `PackageInfo` for each package in the repository,
+    reading only the needed columns from the primary sqlite database.
+    Return `False` if the repository doesn't provide one.
+    """
+    if "primary_db" not in repomd:
+        return False
+    db_path = os.path.join(path, repomd["primary_db"].location_href)
+    if not os.path.isfile(db_path):
+        return False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if not db_path.endswith(".sqlite"):
+            decompressed = os.path.join(tmp, "primary.sqlite")
+            cr.decompress_file(db_path, decompressed, cr.AUTO_DETECT_COMPRESSION)
+            db_path = decompressed
+
+        conn = sqlite3.connect(db_path)
+        try:
+            query = ("SELECT name, arch, epoch, version, release, rpm_sourcerpm "
+                     "FROM packages")
+            for row in conn.execute(query):
+                pkgcb(PackageInfo(*row))
+        finally:
+            conn.close()
+    return True
+
+
+def is_remote(repo_path):
+    """
+    Determine whether `repo_path` is an URL of a remote repository
+    """
+    return urllib.parse.urlparse(repo_path).scheme in ("http", "https", "ftp")
+
+
+def fetch_repodata(baseurl, cachedir=DEFAULT_CACHEDIR, fast=False):
+    """
+    Download `repomd.xml` and the primary metadata (and the primary sqlite
+    database if `fast`) of a remote repository into `cachedir` and return a
+    path to the local copy, which can be passed to `parse_repodata`.
+
+    The metadata are cached per repomd revision, so they are not downloaded
+    again until the remote repository changes. All downloaded files are
+    verified against their checksums in `repomd.xml`.
+    """
+    baseurl = baseurl.rstrip("/") + "/"
+    repo_cachedir = os.path.join(
+        cachedir, hashlib.sha256(baseurl.encode("utf-8")).hexdigest()[:16])
+    os.makedirs(repo_cachedir, exist_ok=True)
+
+    logging.debug("Fetching {0}repodata/repomd.xml".format(baseurl))
+    with urllib.request.urlopen(baseurl + "repodata/repomd.xml") as response:
+        repomd_xml = response.read()
+    with tempfile.NamedTemporaryFile(dir=repo_cachedir, suffix=".xml") as f:
+        f.write(repomd_xml)
+        f.flush()
+        repomd = cr.Repomd(f.name)
+
+    # The revision is an arbitrary string of the remote repository, it is
+    # never used as a path component as it is
+    revision = repomd.revision.encode("utf-8") if repomd.revision else repomd_xml
+    local_path = os.path.join(
+        repo_cachedir, hashlib.sha256(revision).hexdigest()[:16])
+    os.makedirs(os.path.join(local_path, "repodata"), exist_ok=True)
+
+    mdtypes = ["primary", "primary_db"] if fast else ["primary"]
+    for record in repomd.records:
+        if record.type in mdtypes:
+            _fetch_record(baseurl, local_path, record)
+
+    # repomd.xml is written last, so an interrupted download is not
+    # mistaken for complete metadata
+    with open(os.path.join(local_path, "repodata", "repomd.xml"), "wb") as f:
+        f.write(repomd_xml)
+
+    # Only the current revision is worth keeping
+    for name in os.listdir(repo_cachedir):
+        old = os.path.join(repo_cachedir, name)
+        if old != local_path and os.path.isdir(old):
+            shutil.rmtree(old)
+
+    return local_path
+
+
+def _fetch_record(baseurl, local_path, record):
+    dest = os.path.normpath(os.path.join(local_path, record.location_href))
+    if not dest.startswith(local_path + os.sep):
+        raise ValueError("Unexpected metadata location: {0}".format(record.location_href))
+
+    if os.path.isfile(dest) and _checksum(dest, record.checksum_type) == record.checksum:
+        logging.debug("Using cached {0}".format(dest))
+        return
+
+    url = urllib.parse.urljoin(record.location_base or baseurl, record.location_href)
+    logging.debug("Fetching {0}".format(url))
+    part = dest + ".part"
+    with urllib.request.urlopen(url) as response, open(part, "wb") as f:
+        shutil.copyfileobj(response, f)
+
+    if _checksum(part, record.checksum_type) != record.checksum:
+        os.remove(part)
+        raise ValueError("Checksum mismatch for {0}".format(url))
+    os.rename(part, dest)
+
+
+def _checksum(path, checksum_type):
+    # Old repositories use "sha" for SHA-1
+    checksum = hashlib.new("sha1" if checksum_type == "sha" else checksum_type)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def get_srpm_name(filename):
+    """
+    Return the package name from a source RPM file name, e.g.
+    `python-django-3.0.10-3.fc33.src.rpm` -> `python-django`, or `None` if
+    the file name cannot be parsed
+    """
+    if filename.endswith(".rpm"):
+        filename = filename[:-4]
+    match = NEVRA_RE.match(filename)
+    return match.group(1) if match else None
+
+
 def get_source_packages(packages):
     """
     Return the unique set of source package names
     """
-    source_packages = set()
+    content = RepoContent()
     for pkg in packages:
+        content.add_source_package(pkg)
+    return content.get_source_packages()
+
+
+class RepoContent(object):
+    """
+    Running sets of everything that is needed for generating a module from
+    packages of a repository. Packages are added one by one as they are
+    parsed, so they don't need to be retained in memory.
+    """
+
+    def __init__(self):
+        self.srpm_names = set()
+        self.sourcerpms = set()
+        self.artifacts = set()
+        # Used for both the module API and the default profile
+        self.names = set()
+
+    def add_package(self, pkg):
+        """
+        Add a `createrepo_c.Package`
+        """
+        self.artifacts.add(pkg.nevra())
+        self.names.add(pkg.name)
+        self.add_source_package(pkg)
+
+    def add_source_package(self, pkg):
+        """
+        Add only the source package of a `createrepo_c.Package`
+        """
         # In this case, the `pkg` is a SRPM file
         if not pkg.rpm_sourcerpm:
-            source_packages.add(pkg.name)
-            continue
+            self.srpm_names.add(pkg.name)
+        else:
+            self.sourcerpms.add(pkg.rpm_sourcerpm)
+
+    def get_source_packages(self):
+        """
+        Return the unique set of source package names
+        """
+        source_packages = set(self.srpm_names)
+
+        # Many binary packages are built from the same SRPM, so each SRPM
+        # file name is parsed only once
+        for sourcerpm in self.sourcerpms:
+            name = get_srpm_name(sourcerpm)
+            if name:
+                source_packages.add(name)
+
+        return source_packages
+
+    def update(self, other):
+        """
+        Add everything from another `RepoContent`
+        """
+        self.srpm_names |= other.srpm_names
+        self.sourcerpms |= other.sourcerpms
+        self.artifacts |= other.artifacts
+        self.names |= other.names
+
+    def snapshot(self):
+        """
+        Return sorted lists of everything that ends up in the module, which
+        can be stored in JSON and compared with a later `snapshot`
+        """
+        return {
+            "artifacts": sorted(self.artifacts),
+            "names": sorted(self.names),
+            "components": sorted(self.get_source_packages()),
+        }
+
+
+class ArchContent(object):
+    """
+    `RepoContent` of a repository partitioned by package architecture, so
+    a module stream can be generated for each architecture from one parse
+    """
+
+    # Packages of these architectures belong to the streams of all
+    # architectures
+    SHARED_ARCHES = ("noarch", "src")
+
+    def __init__(self):
+        self.arches = {}
+
+    def add_package(self, pkg):
+        """
+        Add a `createrepo_c.Package`
+        """
+        content = self.arches.get(pkg.arch)
+        if content is None:
+            content = self.arches[pkg.arch] = RepoContent()
+        content.add_package(pkg)
+
+    def split(self):
+        """
+        Return a `RepoContent` for each architecture, including the shared
+        packages. A repository with only noarch packages has only a noarch
+        content.
+        """
+        shared = RepoContent()
+        for arch in self.SHARED_ARCHES:
+            if arch in self.arches:
+                shared.update(self.arches[arch])
+
+        arches = set(self.arches) - set(self.SHARED_ARCHES)
+        if not arches:
+            return {"noarch": shared}
+
+        contents = {}
+        for arch in arches:
+            contents[arch] = RepoContent()
+            contents[arch].update(self.arches[arch])
+            contents[arch].update(shared)
+        return contents
 
-        # Get the source RPM NEVRA without the trailing ".rpm"
-        subject = Subject(pkg.rpm_sourcerpm[:-4])
 
-        # Now get just the source RPM name
-        nevras = subject.get_nevra_possibilities(forms=[hawkey.FORM_NEVRA])
-        for nevra in nevras:
-            source_packages.add(nevra.name)
+def resolve_repo_path(repo_path, cachedir=DEFAULT_CACHEDIR, fast=False):
+    """
+    Return a local path to the repository, fetching its metadata first if it
+    is a remote one
+    """
+    if is_remote(repo_path):
+        return fetch_repodata(repo_path, cachedir, fast=fast)
+    return os.path.abspath(repo_path)
+
+
+def get_repo_fingerprint(path):
+    """
+    Return the `repomd.xml` revision and the primary metadata checksum of a
+    local repository, which change whenever its packages change
+    """
+    repomd = cr.Repomd(os.path.join(path, "repodata/repomd.xml"))
+    return {"revision": repomd.revision, "primary": repomd["primary"].checksum}
 
-    return source_packages
+
+def load_repo_content(repo_path, cachedir=DEFAULT_CACHEDIR, fast=False,
+                      multiarch=False):
+    """
+    Parse a local or remote repository and return its `RepoContent`, or a
+    dict of `RepoContent` for each architecture if `multiarch`
+    """
+    local_path = resolve_repo_path(repo_path, cachedir, fast=fast)
+    content = ArchContent() if multiarch else RepoContent()
+    parse_repodata(local_path, pkgcb=content.add_package, fast=fast)
+    return content.split() if multiarch else content
+
+
+def load_repo_contents(repo_paths, workers=1, **kwargs):
+    """
+    Run `load_repo_content` for each of the `repo_paths` and return the
+    results in the same order. With more than one worker, the repositories
+    are parsed in parallel worker processes.
+    """
+    if workers == 1 or len(repo_paths) == 1:
+        return [load_repo_content(repo_path, **kwargs) for repo_path in repo_paths]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(load_repo_content, repo_path, **kwargs)
+                   for repo_path in repo_paths]
+        return [future.result() for future in futures]
+
+
+def get_repo_module_name(repo_path):
+    """
+    Return a module name for a repository, which is its directory name
+    """
+    if is_remote(repo_path):
+        path = urllib.parse.urlparse(repo_path).path
+    else:
+        path = os.path.abspath(repo_path)
+    return os.path.basename(path.rstrip("/"))
+
+
+def new_component(srcpkg):
+    component = Modulemd.ComponentRpm.new(srcpkg)
+    component.set_rationale('Present in the repository')
+    return component
+
+
+def create_module(name, stream_name, version, context, content):
+    """
+    Create a module stream providing all packages from a `RepoContent`, and
+    its defaults
+    """
+    # Create module stream framework
+    stream = Modulemd.ModuleStreamV2.new(name, stream_name)
+    stream.set_version(version)
+    stream.set_context(context)
+    stream.set_summary('<auto-generated module summary>')
+    stream.set_description('<auto-generated module description>')
+    stream.add_module_license("MIT")
+    stream.add_content_license("<FILL THIS IN>")
+
+    # The content is already deduplicated, so every value crosses the
+    # PyGObject boundary only once. Looking up the bound methods only once
+    # also avoids the GObject attribute resolution for each package.
+    add_component = stream.add_component
+    for srcpkg in sorted(content.get_source_packages()):
+        add_component(new_component(srcpkg))
+
+    add_rpm_artifact = stream.add_rpm_artifact
+    for nevra in sorted(content.artifacts):
+        add_rpm_artifact(nevra)
+
+    common_profile = Modulemd.Profile.new(DEFAULT_PROFILE)
+    add_rpm_api = stream.add_rpm_api
+    add_rpm = common_profile.add_rpm
+    for pkgname in sorted(content.names):
+        add_rpm_api(pkgname)
+        add_rpm(pkgname)
+
+    stream.add_profile(common_profile)
+
+    # Add defaults for this module
+    defaults = Modulemd.DefaultsV1.new(name)
+    defaults.set_default_stream(stream_name)
+    defaults.add_default_profile_for_stream(stream_name, DEFAULT_PROFILE)
+
+    return stream, defaults
+
+
+def create_arch_modules(name, stream_name, version, context, contents):
+    """
+    Create a module stream for each architecture from a dict of
+    `RepoContent`, and defaults of the module
+    """
+    streams = []
+    for arch in sorted(contents):
+        stream, defaults = create_module(name, stream_name, version, context,
+                                         contents[arch])
+        stream.set_arch(arch)
+        streams.append(stream)
+    return streams, defaults
+
+
+def update_module(stream, old, new):
+    """
+    Apply the difference between two `RepoContent.snapshot` results to
+    a module stream, that was previously created from the `old` one
+    """
+    old_artifacts, new_artifacts = set(old["artifacts"]), set(new["artifacts"])
+    for nevra in old_artifacts - new_artifacts:
+        stream.remove_rpm_artifact(nevra)
+    for nevra in sorted(new_artifacts - old_artifacts):
+        stream.add_rpm_artifact(nevra)
+
+    profile = stream.get_profile(DEFAULT_PROFILE)
+    old_names, new_names = set(old["names"]), set(new["names"])
+    for pkgname in old_names - new_names:
+        stream.remove_rpm_api(pkgname)
+        profile.remove_rpm(pkgname)
+    for pkgname in sorted(new_names - old_names):
+        stream.add_rpm_api(pkgname)
+        profile.add_rpm(pkgname)
+
+    old_components, new_components = set(old["components"]), set(new["components"])
+    for srcpkg in old_components - new_components:
+        stream.remove_rpm_component(srcpkg)
+    for srcpkg in sorted(new_components - old_components):
+        stream.add_component(new_component(srcpkg))
+
+
+def get_module_stream(index, name, stream_name):
+    """
+    Return a module stream from a `Modulemd.ModuleIndex` or `None`
+    """
+    module = index.get_module(name)
+    if not module:
+        return None
+    for stream in module.get_all_streams():
+        if stream.get_stream_name() == stream_name:
+            return stream
+    return None
+
+
+def read_modules_yaml(path):
+    index = Modulemd.ModuleIndex.new()
+    ret, failures = index.update_from_file(path, True)
+    if not ret:
+        raise ValueError("Could not read {0}".format(path))
+    return index
+
+
+def get_state_path(modules_yaml):
+    """
+    Return a path to the state file kept next to a generated `modules_yaml`
+    for the `--incremental` mode
+    """
+    return modules_yaml + ".state.json"
+
+
+def read_state(modules_yaml, params):
+    """
+    Return the state recorded when `modules_yaml` was generated, or `None` if
+    there is none, it was generated with different `params`, or the file
+    itself was changed since then
+    """
+    try:
+        with open(get_state_path(modules_yaml), "r") as f:
+            state = json.load(f)
+        digest = _checksum(modules_yaml, "sha256")
+    except (OSError, ValueError):
+        return None
+
+    if state.get("params") != params or state.get("output") != digest:
+        logging.debug("Ignoring outdated state of {0}".format(modules_yaml))
+        return None
+    return state
+
+
+def write_state(modules_yaml, params, repos):
+    state = {
+        "params": params,
+        "output": _checksum(modules_yaml, "sha256"),
+        "repos": repos,
+    }
+    with open(get_state_path(modules_yaml), "w") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+
+
+def get_digest(modules_yaml):
+    """
+    Return a SHA-256 digest of a YAML string. The modules are generated in
+    a canonical order, so the same input always has the same digest.
+    """
+    return hashlib.sha256(modules_yaml.encode("utf-8")).hexdigest()
+
+
+def print_digest(digest, path, to_stderr=False):
+    """
+    Print a digest in the `sha256sum` format
+    """
+    output = sys.stderr if to_stderr else sys.stdout
+    output.write("{0}  {1}\n".format(digest, path))
+
+
+def write_modules_yaml(index, path):
+    """
+    Write a `Modulemd.ModuleIndex` into a file and return a digest of it
+    """
+    abs_modules_yaml = os.path.abspath(path)
+    modules_yaml = index.dump_to_string()
+    logging.debug("Writing YAML to {}".format(abs_modules_yaml))
+    try:
+        with open(abs_modules_yaml, 'w', encoding="utf-8") as output:
+            output.write(modules_yaml)
+    except PermissionError as e:
+        logging.error("Could not write YAML to file: {}".format(e))
+        exit(3)
+    return get_digest(modules_yaml)
 
 
 def get_arg_parser():
@@ -88,13 +596,47 @@ def get_arg_parser():
     debug.add_argument("--nodebug", action="store_false", dest="debug")
 
     parser.add_argument("-n", "--module-name",
-                        default=os.path.basename(os.environ.get("PWD")),
                         help="Default is the current directory name")
     parser.add_argument("-s", "--module-stream", default="rolling")
     parser.add_argument("-v", "--module-version", default=1, type=int)
     parser.add_argument("-c", "--module-context", default="abcdef12")
     parser.add_argument("-O", "--to-stdout", default=False, action="store_true")
-    parser.add_argument("repo_path")
+    parser.add_argument("--fast-parse", default=False, action="store_true",
+                        help=("Read only the necessary package fields from "
+                              "the primary sqlite database, if the repository "
+                              "provides one"))
+    parser.add_argument("--cachedir", default=DEFAULT_CACHEDIR,
+                        help=("Where to cache metadata of remote repositories "
+                              "(default: $XDG_CACHE_HOME/repo2module)"))
+    parser.add_argument("-r", "--repo", action="append", metavar="REPO_PATH",
+                        help=("Generate a module also for this repository. "
+                              "For multiple repositories, repeat this option. "
+                              "Each module is then named after the directory "
+                              "name of its repository"))
+    parser.add_argument("-w", "--workers", default=1, type=int,
+                        help=("Number of processes parsing multiple "
+                              "repositories in parallel"))
+    parser.add_argument("--output-dir",
+                        help=("Write one <module name>.modules.yaml file per "
+                              "repository into this directory, instead of "
+                              "one modules_yaml file for all of them"))
+    parser.add_argument("--print-digest", default=False, action="store_true",
+                        help=("Print a SHA-256 digest of each generated file, "
+                              "which is stable for the same input. With "
+                              "--to-stdout, it is printed to STDERR"))
+    parser.add_argument("--multiarch", default=False, action="store_true",
+                        help=("Generate a module stream for each architecture "
+                              "in the repository. The noarch and src packages "
+                              "are part of all of them"))
+    parser.add_argument("--incremental", default=False, action="store_true",
+                        help=("Skip repositories that did not change since "
+                              "the previous run and only apply the changed "
+                              "packages to the previously generated modules. "
+                              "The state is kept in a <modules_yaml>.state.json "
+                              "file"))
+    parser.add_argument("repo_path",
+                        help=("Path to a local repository, or a baseurl of "
+                              "a remote repository"))
     parser.add_argument("modules_yaml", default="modules.yaml", nargs="?")
     return parser
 
@@ -106,61 +648,152 @@ def cli():
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
 
-    if not os.path.isdir(args.repo_path):
-        logging.error("No such directory: {0}".format(args.repo_path))
-        exit(1)
-
-    abs_repo_path = os.path.abspath(args.repo_path)
-    if not args.to_stdout:
-        abs_modules_yaml = os.path.abspath(args.modules_yaml)
-
-    packages = parse_repodata(abs_repo_path)
-
-    # Create module stream framework
-    stream = Modulemd.ModuleStreamV2.new(args.module_name, args.module_stream)
-    stream.set_version(args.module_version)
-    stream.set_context(args.module_context)
-    stream.set_summary('<auto-generated module summary>')
-    stream.set_description('<auto-generated module description>')
-    stream.add_module_license("MIT")
-    stream.add_content_license("<FILL THIS IN>")
+    repo_paths = [args.repo_path] + (args.repo or [])
+    for repo_path in repo_paths:
+        if not is_remote(repo_path) and not os.path.isdir(repo_path):
+            logging.error("No such directory: {0}".format(repo_path))
+            exit(1)
+
+    if len(repo_paths) == 1:
+        names = [args.module_name or os.path.basename(os.environ.get("PWD"))]
+    elif args.module_name:
+        parser.error("--module-name cannot be used with multiple repositories")
+    else:
+        names = [get_repo_module_name(repo_path) for repo_path in repo_paths]
+        if len(set(names)) != len(names):
+            parser.error("Repositories need to have unique directory names")
+
+    if args.output_dir:
+        if args.to_stdout:
+            parser.error("--to-stdout cannot be used with --output-dir")
+        os.makedirs(args.output_dir, exist_ok=True)
+        outputs = [(os.path.join(args.output_dir, name + ".modules.yaml"), [name])
+                   for name in names]
+    else:
+        outputs = [(args.modules_yaml, names)]
+
+    if args.incremental:
+        if args.to_stdout:
+            parser.error("--incremental cannot be used with --to-stdout")
+        if args.multiarch:
+            parser.error("--incremental cannot be used with --multiarch")
+        incremental(outputs, dict(zip(names, repo_paths)), args)
+        return
 
-    source_packages = get_source_packages(packages)
+    try:
+        contents = load_repo_contents(repo_paths, workers=args.workers,
+                                      cachedir=args.cachedir,
+                                      fast=args.fast_parse,
+                                      multiarch=args.multiarch)
+    except (urllib.error.URLError, ValueError, OSError) as e:
+        logging.error("Could not load repository: {0}".format(e))
+        exit(2)
 
-    for srcpkg in source_packages:
-        component = Modulemd.ComponentRpm.new(srcpkg)
-        component.set_rationale('Present in the repository')
-        stream.add_component(component)
+    modules = dict(zip(names, contents))
+    for output, output_names in outputs:
+        index = Modulemd.ModuleIndex.new()
+        for name in output_names:
+            if args.multiarch:
+                streams, defaults = create_arch_modules(
+                    name, args.module_stream, args.module_version,
+                    args.module_context, modules[name])
+            else:
+                stream, defaults = create_module(
+                    name, args.module_stream, args.module_version,
+                    args.module_context, modules[name])
+                streams = [stream]
+            for stream in streams:
+                index.add_module_stream(stream)
+            index.add_defaults(defaults)
+
+        if args.to_stdout:
+            modules_yaml = index.dump_to_string()
+            sys.stdout.write(modules_yaml)
+            if args.print_digest:
+                print_digest(get_digest(modules_yaml), "-", to_stderr=True)
+            continue
 
-    common_profile = Modulemd.Profile.new(DEFAULT_PROFILE)
+        digest = write_modules_yaml(index, output)
+        if args.print_digest:
+            print_digest(digest, output)
 
-    for pkg in packages:
-        stream.add_rpm_artifact(pkg.nevra())
-        stream.add_rpm_api(pkg.name)
-        common_profile.add_rpm(pkg.name)
 
-    stream.add_profile(common_profile)
+def incremental(outputs, repo_paths, args):
+    """
+    Generate only modules of repositories that changed since the previous
+    run, which is recorded in a state file next to each output.
 
-    # Add defaults for this module
-    defaults = Modulemd.DefaultsV1.new(args.module_name)
-    defaults.set_default_stream(args.module_stream)
-    defaults.add_default_profile_for_stream(args.module_stream, DEFAULT_PROFILE)
+    A repository is considered unchanged, when its `repomd.xml` revision and
+    primary metadata checksum are the same. When any repository of an output
+    changed, only the difference of its packages is applied to the
+    previously generated module stream.
+    """
+    params = {
+        "stream": args.module_stream,
+        "version": args.module_version,
+        "context": args.module_context,
+    }
 
-    index = Modulemd.ModuleIndex.new()
-    index.add_module_stream(stream)
-    index.add_defaults(defaults)
+    try:
+        local_paths = {name: resolve_repo_path(path, args.cachedir, args.fast_parse)
+                       for name, path in repo_paths.items()}
+        fingerprints = {name: get_repo_fingerprint(path)
+                        for name, path in local_paths.items()}
+    except (urllib.error.URLError, ValueError, OSError) as e:
+        logging.error("Could not load repository: {0}".format(e))
+        exit(2)
 
-    if args.to_stdout:
-        sys.stdout.write(index.dump_to_string())
-        return
+    # Find out what needs to be parsed for all outputs first, so the
+    # repositories can be parsed in parallel
+    plans = []
+    for output, names in outputs:
+        state = read_state(output, params)
+        if state and set(state["repos"]) != set(names):
+            state = None
+        changed = [name for name in names if not state
+                   or state["repos"][name]["fingerprint"] != fingerprints[name]]
+        if not changed:
+            logging.info("{0} is up to date".format(output))
+            if args.print_digest:
+                print_digest(state["output"], output)
+            continue
+        plans.append((output, names, state, changed))
 
-    logging.debug("Writing YAML to {}".format(abs_modules_yaml))
+    to_parse = [name for _, _, _, changed in plans for name in changed]
     try:
-        with open(abs_modules_yaml, 'w') as output:
-            output.write(index.dump_to_string())
-    except PermissionError as e:
-        logging.error("Could not write YAML to file: {}".format(e))
-        exit(3)
+        contents = load_repo_contents([local_paths[name] for name in to_parse],
+                                      workers=args.workers, fast=args.fast_parse)
+    except (ValueError, OSError) as e:
+        logging.error("Could not load repository: {0}".format(e))
+        exit(2)
+    parsed = dict(zip(to_parse, contents))
+    snapshots = {name: content.snapshot() for name, content in parsed.items()}
+
+    for output, names, state, changed in plans:
+        if state:
+            index = read_modules_yaml(output)
+            for name in changed:
+                logging.debug("Updating module {0} in {1}".format(name, output))
+                stream = get_module_stream(index, name, args.module_stream)
+                update_module(stream, state["repos"][name]["packages"], snapshots[name])
+        else:
+            index = Modulemd.ModuleIndex.new()
+            for name in names:
+                stream, defaults = create_module(
+                    name, args.module_stream, args.module_version,
+                    args.module_context, parsed[name])
+                index.add_module_stream(stream)
+                index.add_defaults(defaults)
+
+        digest = write_modules_yaml(index, output)
+        if args.print_digest:
+            print_digest(digest, output)
+
+        repos = {}
+        for name in names:
+            packages = snapshots.get(name) or state["repos"][name]["packages"]
+            repos[name] = {"fingerprint": fingerprints[name], "packages": packages}
+        write_state(output, params, repos)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,77 @@
+"""
+Recursive directory traversal shared by the tools searching for RPM packages
+and module YAML files in large directory trees.
+"""
+
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def iter_files(path, match, workers=1, max_depth=None, exclude=None,
+               followlinks=False):
+    """
+    Recursively find files within `path` for which `match(entry)` returns
+    `True` and yield their paths one by one, as the directories are listed.
+    The `entry` is an `os.DirEntry`.
+
+    Directories are listed with `os.scandir` by a pool of `workers` threads,
+    which helps on network filesystems where each directory listing waits
+    for a server roundtrip. Directories deeper than `max_depth` are not
+    listed (`0` means only `path` itself), and files and directories for
+    which `exclude(entry)` returns `True` are skipped. Unreadable
+    directories are skipped the same way `os.walk` does.
+
+    With `followlinks`, symlinks to directories are followed, but every
+    directory is listed only once, so symlink loops don't cause an infinite
+    recursion.
+    """
+    visited = set()
+    lock = threading.Lock()
+
+    def first_visit(stat):
+        key = (stat.st_dev, stat.st_ino)
+        with lock:
+            if key in visited:
+                return False
+            visited.add(key)
+            return True
+
+    def scan(directory, depth):
+        files, subdirs = [], []
+        try:
+            entries = list(os.scandir(directory))
+        except OSError:
+            return files, subdirs
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=followlinks):
+                if max_depth is not None and depth >= max_depth:
+                    continue
+                if exclude and exclude(entry):
+                    continue
+                if not followlinks or first_visit(entry.stat()):
+                    subdirs.append((entry.path, depth + 1))
+            elif match(entry) and not (exclude and exclude(entry)):
+                files.append(entry.path)
+        return files, subdirs
+
+    if followlinks:
+        first_visit(os.stat(path))
+
+    if workers == 1:
+        pending = [(path, 0)]
+        while pending:
+            files, subdirs = scan(*pending.pop())
+            yield from files
+            pending.extend(subdirs)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(scan, path, 0)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, subdirs = future.result()
+                yield from files
+                for subdir, depth in subdirs:
+                    pending.add(executor.submit(scan, subdir, depth))
@@ -2,11 +2,18 @@ import glob
 import logging
 import os.path
 import shutil
+import threading
 
 import pytest
+from gi.repository import GLib
 
+from modulemd_tools.createrepo_mod import createrepo_mod
 from modulemd_tools.createrepo_mod.createrepo_mod import (
-    run_createrepo, run_modifyrepo, find_module_yamls, dump_modules_yaml)
+    run_createrepo, run_modifyrepo, find_module_yamls, dump_modules_yaml,
+    createrepo_library, modifyrepo_library, process_repositories,
+    read_batch_file, compress_file_parallel, DirectoryWatcher,
+    compute_fingerprint, process_repository, scan_directory, parse_arguments,
+    generate_repository, watch_repository, DEFAULT_SCAN_EXCLUDES)
 
 
 logger = logging.getLogger(__name__)
@@ -51,3 +58,282 @@ def test_run_modifyrepo(test_output_dir):
     retval = run_modifyrepo(test_output_dir, compress_type="gz")
     assert glob.glob(os.path.join(test_output_dir, "repodata", "*-modules.yaml.gz"))
     assert retval == 0
+
+
+def test_createrepo_modifyrepo_library(tmpdir):
+    for package in glob.glob(os.path.join(test_packages_dir, "*.rpm")):
+        shutil.copy(package, str(tmpdir))
+    shutil.copy(os.path.join(test_module_yamls_dir, "dummy.yaml"),
+                os.path.join(str(tmpdir), "modules.yaml"))
+
+    progress = []
+    createrepo_library(str(tmpdir), lambda done, total: progress.append((done, total)))
+    assert progress == [(1, 1)]
+    assert glob.glob(os.path.join(str(tmpdir), "repodata", "*-primary.xml.gz"))
+
+    modifyrepo_library(str(tmpdir), compress_type="gz")
+    modules = glob.glob(os.path.join(str(tmpdir), "repodata", "*-modules.yaml.gz"))
+    assert len(modules) == 1
+    with open(os.path.join(str(tmpdir), "repodata", "repomd.xml")) as f:
+        assert os.path.basename(modules[0]) in f.read()
+
+
+def test_read_batch_file(tmpdir):
+    batch = tmpdir.join("batch.txt")
+    batch.write("# comment\n/foo\n\n  /bar  \n")
+    assert read_batch_file(str(batch)) == ["/foo", "/bar"]
+
+
+@pytest.mark.parametrize("argv, path, createrepo_args", [
+    (["/repo"], ["/repo"], []),
+    (["/repo", "--update"], ["/repo"], ["--update"]),
+    (["--workers", "4", "/repo"], ["/repo"], ["--workers", "4"]),
+    (["-x", "*.src.rpm", "/repo"], ["/repo"], ["-x", "*.src.rpm"]),
+    (["/repo", "--workers", "4", "--engine", "subprocess"], ["/repo"],
+     ["--workers", "4"]),
+    (["--engine=subprocess", "--workers=4", "/repo"], ["/repo"], ["--workers=4"]),
+    (["/foo", "/bar", "--update"], ["/foo", "/bar"], ["--update"]),
+    (["--batch-workers", "2", "/foo", "/bar"], ["/foo", "/bar"], []),
+    (["--workers", "4", "/foo", "/bar"], ["/bar"], ["--workers", "4", "/foo"]),
+    (["--batch", "repos.txt", "--update"], [], ["--update"]),
+    (["--batch", "repos.txt", "--workers", "4"], [], ["--workers", "4"]),
+    (["--batch", "repos.txt", "-x", "*.src.rpm"], [], ["-x", "*.src.rpm"]),
+    (["--batch", "repos.txt", "/foo", "--workers", "4"], ["/foo"], ["--workers", "4"]),
+])
+def test_parse_arguments(argv, path, createrepo_args):
+    _, args, rest = parse_arguments(argv)
+    assert args.path == path
+    assert rest == createrepo_args
+
+
+def test_parse_arguments_own_options():
+    _, args, rest = parse_arguments(["--workers", "4", "--engine", "library", "/repo"])
+    assert args.engine == "library"
+    assert rest == ["--workers", "4"]
+
+
+def test_process_repositories(tmpdir):
+    repo = tmpdir.mkdir("repo")
+    for package in glob.glob(os.path.join(test_packages_dir, "*.rpm")):
+        shutil.copy(package, str(repo))
+    missing = os.path.join(str(tmpdir), "missing")
+
+    results = process_repositories([str(repo), missing], workers=2,
+                                   engine="library")
+    assert [path for path, _, _ in results] == [str(repo), missing]
+    assert results[0][1] is None
+    assert isinstance(results[1][1], OSError)
+    assert os.path.isfile(os.path.join(str(repo), "repodata", "repomd.xml"))
+
+
+def test_process_repositories_modulemd_error(tmpdir, monkeypatch):
+    def process_repository(path, *args, **kwargs):
+        raise GLib.Error("Failed to merge")
+
+    monkeypatch.setattr(createrepo_mod, "process_repository", process_repository)
+    results = process_repositories([str(tmpdir)], engine="library")
+    assert isinstance(results[0][1], GLib.Error)
+
+
+@pytest.mark.skipif(not shutil.which("zstd"), reason="requires zstd")
+def test_compress_file_parallel(tmpdir):
+    src = os.path.join(str(tmpdir), "modules.yaml")
+    shutil.copy(os.path.join(test_module_yamls_dir, "dummy.yaml"), src)
+    compressed = compress_file_parallel(src, "zstd", threads=2)
+    assert compressed == src + ".zst"
+    assert os.path.isfile(src)
+    with open(compressed, "rb") as f:
+        assert f.read(4) == b"\x28\xb5\x2f\xfd"
+
+
+@pytest.mark.parametrize("kwargs, modules_step", [
+    ({}, False),
+    ({"compress_type": "zstd"}, True),
+    ({"compress_threads": 0}, True),
+    ({"scan_options": {"workers": 4, "excludes": DEFAULT_SCAN_EXCLUDES}}, False),
+    ({"scan_options": {"max_depth": 1}}, True),
+    ({"scan_options": {"excludes": DEFAULT_SCAN_EXCLUDES + ["Packages"]}}, True),
+])
+def test_generate_repository_builtin_module_support(tmpdir, monkeypatch, kwargs,
+                                                    modules_step):
+    calls = []
+    monkeypatch.setattr(createrepo_mod, "createrepo_c_with_builtin_module_support",
+                        lambda: True)
+    monkeypatch.setattr(createrepo_mod, "run_createrepo",
+                        lambda args: calls.append(("createrepo", args)))
+    monkeypatch.setattr(createrepo_mod, "find_module_yamls",
+                        lambda path, **options: ["foo.yaml"])
+    monkeypatch.setattr(createrepo_mod, "dump_modules_yaml",
+                        lambda path, yamls: calls.append(("merge", yamls)))
+    monkeypatch.setattr(createrepo_mod, "run_modifyrepo",
+                        lambda path, *args: calls.append(("modifyrepo", args)))
+
+    generate_repository(str(tmpdir), **kwargs)
+    assert calls[0] == ("createrepo", [str(tmpdir)])
+    assert (len(calls) == 3) == modules_step
+    if modules_step:
+        assert calls[2] == ("modifyrepo", (kwargs.get("compress_type", "gz"),
+                                           kwargs.get("compress_threads", 1)))
+
+
+@pytest.mark.skipif(not shutil.which("zstd"), reason="requires zstd")
+@pytest.mark.parametrize("modifyrepo", [run_modifyrepo, modifyrepo_library])
+def test_modifyrepo_parallel_compression(tmpdir, modifyrepo):
+    for package in glob.glob(os.path.join(test_packages_dir, "*.rpm")):
+        shutil.copy(package, str(tmpdir))
+    shutil.copy(os.path.join(test_module_yamls_dir, "dummy.yaml"),
+                os.path.join(str(tmpdir), "modules.yaml"))
+    createrepo_library(str(tmpdir))
+
+    modifyrepo(str(tmpdir), compress_type="zstd", threads=2)
+    assert glob.glob(os.path.join(str(tmpdir), "repodata", "*-modules.yaml.zst"))
+    assert not tmpdir.join("modules.yaml.zst").check()
+
+
+def test_directory_watcher(tmpdir):
+    tmpdir.mkdir("repodata").join("repomd.xml").write("")
+    tmpdir.join("modules.yaml").write("")
+    tmpdir.join("foo.rpm").write("")
+    watcher = DirectoryWatcher(str(tmpdir), debounce=0.1)
+    assert sorted(watcher.snapshot) == ["foo.rpm", "modules.yaml"]
+
+    def change():
+        tmpdir.join("foo.rpm").remove()
+        tmpdir.mkdir("sub").join("bar.yaml").write("")
+
+    threading.Timer(0.2, change).start()
+    assert watcher.wait() == {"foo.rpm", os.path.join("sub", "bar.yaml")}
+
+
+def test_directory_watcher_scan_options(tmpdir):
+    tmpdir.mkdir(".git").join("foo.rpm").write("")
+    tmpdir.join(".git", "foo.yaml").write("")
+    tmpdir.mkdir("excluded").join("foo.rpm").write("")
+    tmpdir.join("excluded", "foo.yaml").write("")
+    tmpdir.mkdir("sub").join("foo.rpm").write("")
+    tmpdir.join("sub", "foo.yaml").write("")
+    tmpdir.join("foo.yaml").write("")
+
+    watcher = DirectoryWatcher(str(tmpdir), excludes=["excluded"], max_depth=0)
+    assert sorted(watcher.snapshot) == [
+        os.path.join("excluded", "foo.rpm"),
+        "foo.yaml",
+        os.path.join("sub", "foo.rpm"),
+    ]
+
+
+def test_watch_repository(tmpdir, monkeypatch, capsys):
+    shutil.copy(os.path.join(test_module_yamls_dir, "dummy.yaml"),
+                os.path.join(str(tmpdir), "modules.yaml"))
+    tmpdir.join("foo.rpm").write("")
+    with open(os.path.join(str(tmpdir), "modules.yaml")) as f:
+        original = f.read()
+
+    createrepo_calls, modifyrepo_calls = [], []
+
+    def createrepo_library(path, **kwargs):
+        createrepo_calls.append(path)
+        if len(createrepo_calls) == 1:
+            raise createrepo_mod.cr.CreaterepoCError("Failed to index")
+
+    def modifyrepo_library(path, compress_type, threads, modules_yaml):
+        assert os.path.dirname(modules_yaml) != str(tmpdir)
+        with open(modules_yaml) as f:
+            assert "dummy" in f.read()
+        modifyrepo_calls.append(modules_yaml)
+
+    changes = [{"foo.rpm"}, {"modules.yaml"}]
+
+    def wait(self):
+        if not changes:
+            raise KeyboardInterrupt
+        return changes.pop(0)
+
+    monkeypatch.setattr(createrepo_mod, "createrepo_library", createrepo_library)
+    monkeypatch.setattr(createrepo_mod, "modifyrepo_library", modifyrepo_library)
+    monkeypatch.setattr(DirectoryWatcher, "wait", wait)
+
+    with pytest.raises(KeyboardInterrupt):
+        watch_repository(str(tmpdir), engine="library")
+
+    # The failed initial update is reported and done again after the first
+    # change, the second change only updates the modules record
+    assert "Failed to index" in capsys.readouterr().err
+    assert len(createrepo_calls) == 2
+    assert len(modifyrepo_calls) == 2
+    assert not os.path.exists(modifyrepo_calls[0])
+    with open(os.path.join(str(tmpdir), "modules.yaml")) as f:
+        assert f.read() == original
+
+
+def test_compute_fingerprint(tmpdir):
+    tmpdir.join("foo.rpm").write("foo")
+    fingerprint = compute_fingerprint(str(tmpdir))
+    assert fingerprint == compute_fingerprint(str(tmpdir))
+    assert fingerprint != compute_fingerprint(str(tmpdir), ["--update"])
+
+    # Repodata and the generated modules.yaml are ignored
+    tmpdir.mkdir("repodata").join("repomd.xml").write("")
+    tmpdir.join("modules.yaml").write("")
+    assert fingerprint == compute_fingerprint(str(tmpdir))
+
+    tmpdir.join("foo.rpm").write("foobar")
+    assert fingerprint != compute_fingerprint(str(tmpdir))
+
+
+def test_compute_fingerprint_symlinks(tmpdir):
+    repo = tmpdir.mkdir("repo")
+    target = tmpdir.join("foo.rpm")
+    target.write("foo")
+    repo.join("foo.rpm").mksymlinkto(target)
+    fingerprint = compute_fingerprint(str(repo))
+
+    # The change of the symlinked file itself is noticed
+    target.write("foobar")
+    assert fingerprint != compute_fingerprint(str(repo))
+
+    # Dangling symlinks don't break the fingerprint, and it changes once
+    # their target appears
+    repo.join("bar.rpm").mksymlinkto(tmpdir.join("bar.rpm"))
+    fingerprint = compute_fingerprint(str(repo))
+    assert fingerprint == compute_fingerprint(str(repo))
+    tmpdir.join("bar.rpm").write("bar")
+    assert fingerprint != compute_fingerprint(str(repo))
+
+
+def test_process_repository_skip_unchanged(tmpdir, capsys):
+    for package in glob.glob(os.path.join(test_packages_dir, "*.rpm")):
+        shutil.copy(package, str(tmpdir))
+    process_repository(str(tmpdir), engine="library", skip_unchanged=True)
+    assert "Skipping" not in capsys.readouterr().out
+    process_repository(str(tmpdir), engine="library", skip_unchanged=True)
+    assert "Skipping" in capsys.readouterr().out
+
+    # Different scan options may find different module YAML files
+    process_repository(str(tmpdir), engine="library", skip_unchanged=True,
+                       scan_options={"max_depth": 0})
+    assert "Skipping" not in capsys.readouterr().out
+    process_repository(str(tmpdir), engine="library", skip_unchanged=True,
+                       scan_options={"max_depth": 0})
+    assert "Skipping" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_scan_directory(tmpdir, workers):
+    tmpdir.join("a.yaml").write("")
+    tmpdir.join("b.txt").write("")
+    tmpdir.mkdir("repodata").join("modules.yaml.gz").write("")
+    tmpdir.mkdir("sub").mkdir("deeper").join("c.yaml.gz").write("")
+    tmpdir.join("sub").join("skip.yaml").write("")
+
+    def scan(**kwargs):
+        found = scan_directory(str(tmpdir), (".yaml", ".yaml.gz"),
+                               workers=workers, **kwargs)
+        return [os.path.relpath(p, str(tmpdir)) for p in found]
+
+    assert scan(excludes=["repodata"]) == [
+        "a.yaml", "sub/deeper/c.yaml.gz", "sub/skip.yaml"]
+    assert scan(excludes=["repodata", "sub/skip.yaml"]) == [
+        "a.yaml", "sub/deeper/c.yaml.gz"]
+    assert scan(excludes=["repodata"], max_depth=1) == ["a.yaml", "sub/skip.yaml"]
+    assert scan(max_depth=0) == ["a.yaml"]
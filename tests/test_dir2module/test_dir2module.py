@@ -1,8 +1,16 @@
-import unittest
+import io
 import os.path
+import shutil
+import threading
+import unittest
+from unittest import mock
+
+import pytest
 
 from modulemd_tools.dir2module.dir2module import (
-    Module, Package, find_packages, parse_nsvca, parse_dependencies)
+    Module, Package, find_packages, parse_nsvca, parse_dependencies, load_packages,
+    HeaderReader, HeaderCache, find_packages_in_file, iter_packages_in_file,
+    iter_packages)
 
 
 dirname = os.path.dirname(os.path.realpath(__file__))
@@ -26,6 +34,19 @@ def test_dummy_module_dumps(dummy_module, dummy_module_mmd_as_string):
     assert output == dummy_module_mmd_as_string
 
 
+def test_module_package_views(dummy_module):
+    packages = [mock.Mock(nevra="foo-0:1-1.noarch"), mock.Mock(nevra="foo-0:2-1.noarch")]
+    for package in packages:
+        package.name = "foo"
+    m = Module(**dict(dummy_module, packages=packages))
+    assert m.package_names == {"foo"}
+    assert m.package_nevras == {"foo-0:1-1.noarch", "foo-0:2-1.noarch"}
+    assert m.package_names is m.package_names
+
+    m.packages = packages[:1]
+    assert m.package_nevras == {"foo-0:1-1.noarch"}
+
+
 def test_normal_package_loading():
     p = Package(os.path.join(test_packages_dir,
                              "python-django-bash-completion-3.0.10-3.fc33.noarch.rpm"))
@@ -51,6 +72,113 @@ def test_modular_package_has_modularity_label():
     assert p.has_modularity_label is True
 
 
+@pytest.mark.parametrize("workers", [1, 4])
+def test_load_packages(workers):
+    paths = sorted(find_packages(test_packages_dir))
+    packages = load_packages(paths, workers=workers)
+    assert [package.path for package in packages] == paths
+    assert [package.has_modularity_label for package in packages] == [True, False]
+    assert {package.license for package in packages} == {"BSD"}
+
+
+def test_package_keeps_only_needed_fields():
+    p = Package(os.path.join(test_packages_dir,
+                             "python-django-bash-completion-3.0.10-3.fc33.noarch.rpm"))
+    assert p.name == "python-django-bash-completion"
+    assert not hasattr(p, "header")
+    assert not hasattr(p, "__dict__")
+
+
+def test_package_nevra(tmpdir):
+    p = Package(os.path.join(
+        test_packages_dir,
+        "python-django-bash-completion-1.6.11.8-1.module_f33+9570+f65235c8.noarch.rpm"))
+    assert p.nevra == \
+        "python-django-bash-completion-0:1.6.11.8-1.module_f33+9570+f65235c8.noarch"
+
+    # The file name doesn't matter
+    path = str(tmpdir.join("renamed"))
+    shutil.copy(os.path.join(test_packages_dir,
+                             "python-django-bash-completion-3.0.10-3.fc33.noarch.rpm"), path)
+    assert Package(path).nevra == "python-django-bash-completion-0:3.0.10-3.fc33.noarch"
+
+
+def test_header_reader():
+    reader = HeaderReader()
+    path = os.path.join(test_packages_dir,
+                        "python-django-bash-completion-3.0.10-3.fc33.noarch.rpm")
+    assert reader.read(path)["name"] == "python-django-bash-completion"
+    assert reader.transaction_set is reader.transaction_set
+
+    # Every thread has its own transaction set
+    other = []
+    thread = threading.Thread(target=lambda: other.append(reader.transaction_set))
+    thread.start()
+    thread.join()
+    assert other[0] is not reader.transaction_set
+
+
+def test_header_cache(tmpdir):
+    path = str(tmpdir.join("package.rpm"))
+    shutil.copy(os.path.join(test_packages_dir,
+                             "python-django-bash-completion-3.0.10-3.fc33.noarch.rpm"), path)
+    cache_path = str(tmpdir.join("cache.json"))
+
+    cache = HeaderCache(cache_path)
+    header = cache.read(path)
+    assert header["name"] == "python-django-bash-completion"
+    assert set(header) == set(HeaderCache.FIELDS)
+    packages = load_packages([path], cache=cache)
+    assert packages[0].nevra == "python-django-bash-completion-0:3.0.10-3.fc33.noarch"
+    cache.save()
+
+    cache = HeaderCache(cache_path)
+    with mock.patch("modulemd_tools.dir2module.dir2module.read_header") as read_header:
+        assert cache.read(path) == header
+        read_header.assert_not_called()
+
+        # The package changed
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        cache.read(path)
+        read_header.assert_called_once_with(path)
+
+
+@pytest.fixture
+def package_tree(tmpdir):
+    """
+    A directory tree with a few empty RPM-like files and a symlink loop
+    """
+    for path in ["foo-1-1.x86_64.rpm", "foo-1-1.src.rpm", "notes.txt",
+                 "a/bar-1-1.noarch.rpm", "a/b/baz-1-1.x86_64.rpm"]:
+        tmpdir.join(path).ensure()
+    os.symlink(str(tmpdir), str(tmpdir.join("a", "b", "loop")))
+    os.symlink(str(tmpdir.join("a")), str(tmpdir.join("link")))
+    return str(tmpdir)
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_find_packages(package_tree, workers):
+    found = find_packages(package_tree, workers=workers)
+    assert sorted(os.path.relpath(path, package_tree) for path in found) == [
+        "a/b/baz-1-1.x86_64.rpm", "a/bar-1-1.noarch.rpm", "foo-1-1.x86_64.rpm"]
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_find_packages_followlinks(package_tree, workers):
+    found = find_packages(package_tree, workers=workers, followlinks=True)
+    # Every directory is visited only once, either directly or via a link
+    assert len(found) == 3
+    assert sorted(os.path.basename(path) for path in found) == [
+        "bar-1-1.noarch.rpm", "baz-1-1.x86_64.rpm", "foo-1-1.x86_64.rpm"]
+
+
+@pytest.mark.parametrize("followlinks", [False, True])
+def test_iter_packages_missing_directory(tmpdir, followlinks):
+    with pytest.raises(ValueError):
+        iter_packages(str(tmpdir.join("missing")), followlinks=followlinks)
+
+
 @unittest.skip("Does not work with the latest libmodulemd (2.12.0)")
 def test_find_packages_in_directory():
     packages_files = [os.path.basename(rpm_abs_path)
@@ -61,6 +189,37 @@ def test_find_packages_in_directory():
     ]
 
 
+def test_find_packages_in_file(tmpdir):
+    pkglist = tmpdir.join("foo.pkglist")
+    pkglist.write("\n".join([
+        "foo-2.8-1.fc32.x86_64.rpm",
+        "",
+        os.path.join(test_packages_dir, "*.fc33.noarch.rpm"),
+        "  bar-1.2-3.fc32.x86_64.rpm  ",
+    ]))
+    assert find_packages_in_file(str(pkglist)) == [
+        "foo-2.8-1.fc32.x86_64.rpm",
+        os.path.join(test_packages_dir, "python-django-bash-completion-3.0.10-3.fc33.noarch.rpm"),
+        "bar-1.2-3.fc32.x86_64.rpm",
+    ]
+
+
+def test_find_packages_in_file_globs(tmpdir):
+    tmpdir.join("foo[1].rpm").ensure()
+    pkglist = tmpdir.join("foo.pkglist")
+    pkglist.write(str(tmpdir.join("foo[1].rpm")))
+    assert find_packages_in_file(str(pkglist)) == [str(tmpdir.join("foo[1].rpm"))]
+
+    pkglist.write(str(tmpdir.join("bar*.rpm")))
+    with pytest.raises(ValueError):
+        find_packages_in_file(str(pkglist))
+
+
+def test_find_packages_in_stdin(monkeypatch):
+    monkeypatch.setattr("sys.stdin", io.StringIO("foo.rpm\n\nbar.rpm\n"))
+    assert list(iter_packages_in_file("-")) == ["foo.rpm", "bar.rpm"]
+
+
 def test_parse_nsvca():
     assert parse_nsvca("dummy:0:1:2:noarch") == ['dummy', '0', 1, '2', 'noarch']
 
@@ -85,3 +85,13 @@ def test_modulemd_merge_module_with_repomd_file(tmp_file, module_with_repodata_d
     with open(tmp_file, "r") as f:
         assert [d for d in yaml.load_all(f, Loader=yaml.SafeLoader)] == [
             d for d in yaml.load_all(module_with_repodata_dir, Loader=yaml.SafeLoader)]
+
+
+def test_iter_index_documents(two_modules_merged_yamls):
+    index = modulemd_merge.Modulemd.ModuleIndex.new()
+    index.update_from_string(two_modules_merged_yamls, True)
+
+    documents = list(modulemd_merge.iter_index_documents(index))
+    assert len(documents) == 4
+    assert [d for d in yaml.load_all("".join(documents), Loader=yaml.SafeLoader)] == [
+        d for d in yaml.load_all(two_modules_merged_yamls, Loader=yaml.SafeLoader)]
@@ -0,0 +1,48 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+# Maximum time for importing a tool module, including all of its
+# dependencies, in milliseconds
+IMPORT_TIME_BUDGET = int(os.environ.get("MODULEMD_TOOLS_IMPORT_TIME_BUDGET", 1000))
+
+# Modules that are too slow to import just for starting a tool
+HEAVY_MODULES = ["dnf", "hawkey"]
+
+
+def import_time(module):
+    """
+    Import `module` in a new interpreter with `-X importtime` and return the
+    cumulative import time of all modules in milliseconds, and the names of
+    all imported modules
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                             "import {0}".format(module)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True)
+    total = 0
+    imported = set()
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        imported.add(name.strip())
+        # Only top-level imports, nested ones are included in their cumulative time
+        if not name.startswith("  "):
+            total += int(cumulative)
+    return total / 1000, imported
+
+
+@pytest.mark.parametrize("module", [
+    "modulemd_tools.repo2module.cli",
+    "modulemd_tools.dir2module.dir2module",
+])
+def test_import_time(module):
+    elapsed, imported = import_time(module)
+    assert not imported.intersection(HEAVY_MODULES)
+    assert elapsed < IMPORT_TIME_BUDGET, \
+        "Importing {0} took {1:.0f}ms".format(module, elapsed)
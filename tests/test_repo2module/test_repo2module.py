@@ -1,12 +1,25 @@
-import unittest
+import functools
+import http.server
 import os.path
+import shutil
+import subprocess
+import sys
+import threading
+import unittest
+
 import createrepo_c
+import pytest
 import modulemd_tools.repo2module.cli
-from modulemd_tools.repo2module.cli import parse_repodata, get_source_packages
+from modulemd_tools.repo2module.cli import (
+    parse_repodata, get_source_packages, get_srpm_name, RepoContent, PackageInfo,
+    fetch_repodata, is_remote, load_repo_content, load_repo_contents,
+    get_repo_module_name, get_repo_fingerprint, update_module, read_state,
+    write_state, ArchContent, create_module, get_digest, cli, DEFAULT_PROFILE)
 
 
 dirname = os.path.dirname(os.path.realpath(__file__))
 test_repo_dir = os.path.join(dirname, "rpmrepo")
+project_dir = os.path.dirname(os.path.dirname(dirname))
 
 
 def test_cli_module_loading():
@@ -26,6 +39,268 @@ def test_get_source_packages():
     assert source_packages == {'python-django'}
 
 
+def test_parse_repodata_streaming():
+    content = RepoContent()
+    assert parse_repodata(test_repo_dir, pkgcb=content.add_package) == []
+    assert content.artifacts == {"python-django-bash-completion-0:3.0.10-3.fc33.noarch"}
+    assert content.names == {"python-django-bash-completion"}
+    assert content.get_source_packages() == {"python-django"}
+
+
+def test_parse_repodata_fast():
+    packages = parse_repodata(test_repo_dir, fast=True)
+    assert all(isinstance(pkg, PackageInfo) for pkg in packages)
+    expected = parse_repodata(test_repo_dir)
+    assert [(p.name, p.nevra(), p.rpm_sourcerpm) for p in packages] == [
+        (p.name, p.nevra(), p.rpm_sourcerpm) for p in expected]
+
+
+def test_load_repo_contents(tmpdir):
+    other_repo_dir = str(tmpdir.join("other"))
+    shutil.copytree(test_repo_dir, other_repo_dir)
+    expected = load_repo_content(test_repo_dir)
+    for workers in (1, 2):
+        contents = load_repo_contents([test_repo_dir, other_repo_dir], workers=workers)
+        assert [c.artifacts for c in contents] == [expected.artifacts] * 2
+        assert [c.get_source_packages() for c in contents] == [{"python-django"}] * 2
+
+
+def test_get_repo_module_name():
+    assert get_repo_module_name("/srv/repos/foo/") == "foo"
+    assert get_repo_module_name("https://example.com/repos/bar/") == "bar"
+
+
+def test_get_repo_fingerprint():
+    fingerprint = get_repo_fingerprint(test_repo_dir)
+    assert fingerprint == get_repo_fingerprint(test_repo_dir)
+    assert fingerprint["revision"]
+    assert len(fingerprint["primary"]) == 64
+
+
+def test_content_snapshot():
+    assert load_repo_content(test_repo_dir).snapshot() == {
+        "artifacts": ["python-django-bash-completion-0:3.0.10-3.fc33.noarch"],
+        "names": ["python-django-bash-completion"],
+        "components": ["python-django"],
+    }
+
+
+def make_content(artifacts, names, components):
+    content = RepoContent()
+    content.artifacts = set(artifacts)
+    content.names = set(names)
+    content.srpm_names = set(components)
+    return content
+
+
+def test_update_module():
+    old = make_content(["a-0:1-1.noarch", "b-0:1-1.noarch"], ["a", "b"], ["ab"])
+    new = make_content(["a-0:1-1.noarch", "c-0:2-1.noarch"], ["a", "c"], ["ac"])
+    stream, _ = create_module("foo", "devel", 1, "abcd", old)
+    update_module(stream, old.snapshot(), new.snapshot())
+
+    expected, _ = create_module("foo", "devel", 1, "abcd", new)
+    assert stream.get_rpm_artifacts() == ["a-0:1-1.noarch", "c-0:2-1.noarch"]
+    assert stream.get_rpm_api() == ["a", "c"]
+    assert stream.get_rpm_component_names() == ["ac"]
+    assert stream.get_profile(DEFAULT_PROFILE).get_rpms() == ["a", "c"]
+    assert stream.equals(expected)
+
+
+def test_read_state(tmpdir):
+    modules_yaml = str(tmpdir.join("modules.yaml"))
+    params = {"stream": "rolling", "version": 1, "context": "abcdef12"}
+    assert read_state(modules_yaml, params) is None
+
+    with open(modules_yaml, "w") as f:
+        f.write("---\n")
+    write_state(modules_yaml, params, {"foo": {}})
+    assert read_state(modules_yaml, params)["repos"] == {"foo": {}}
+    assert read_state(modules_yaml, dict(params, version=2)) is None
+
+    # The output changed since the state was written
+    with open(modules_yaml, "a") as f:
+        f.write("...\n")
+    assert read_state(modules_yaml, params) is None
+
+
+def test_arch_content():
+    content = ArchContent()
+    content.add_package(PackageInfo("foo", "x86_64", "0", "1", "1", "foo-1-1.src.rpm"))
+    content.add_package(PackageInfo("foo", "aarch64", "0", "1", "1", "foo-1-1.src.rpm"))
+    content.add_package(PackageInfo("foo-doc", "noarch", "0", "1", "1", "foo-1-1.src.rpm"))
+    content.add_package(PackageInfo("foo", "src", "0", "1", "1", None))
+
+    contents = content.split()
+    assert set(contents) == {"x86_64", "aarch64"}
+    assert contents["x86_64"].artifacts == {
+        "foo-0:1-1.x86_64", "foo-doc-0:1-1.noarch", "foo-0:1-1.src"}
+    assert contents["aarch64"].names == {"foo", "foo-doc"}
+    assert contents["aarch64"].get_source_packages() == {"foo"}
+
+
+def test_arch_content_noarch():
+    contents = load_repo_content(test_repo_dir, multiarch=True)
+    assert list(contents) == ["noarch"]
+    assert contents["noarch"].artifacts == load_repo_content(test_repo_dir).artifacts
+
+
+# Writes a module of packages named by the arguments, in that order, and
+# prints the digest of the output
+DIGEST_SCRIPT = """
+import sys
+from modulemd_tools.repo2module.cli import (
+    Modulemd, RepoContent, PackageInfo, create_module, write_modules_yaml)
+
+content = RepoContent()
+for name in sys.argv[2:]:
+    content.add_package(PackageInfo(name, "x86_64", "0", "1", "1",
+                                    "{0}-1-1.src.rpm".format(name)))
+stream, defaults = create_module("shells", "rolling", 1, "abcdef12", content)
+index = Modulemd.ModuleIndex.new()
+index.add_module_stream(stream)
+index.add_defaults(defaults)
+print(write_modules_yaml(index, sys.argv[1]))
+"""
+
+
+def test_create_module_stable_digest(tmpdir):
+    names = ["zsh", "bash", "fish", "dash", "tcsh", "ksh", "mksh", "yash"]
+    digests = set()
+    # Different order of the packages and different hash seeds, which change
+    # the iteration order of the sets in RepoContent
+    for seed, order in [("0", names), ("1", names[::-1]), ("2", sorted(names))]:
+        output = str(tmpdir.join(seed + ".modules.yaml"))
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        digest = subprocess.check_output(
+            [sys.executable, "-c", DIGEST_SCRIPT, output] + order,
+            cwd=project_dir, env=env)
+        digests.add(digest.strip())
+        with open(output, "rb") as f:
+            assert get_digest(f.read().decode("utf-8")) == digest.strip().decode()
+    assert len(digests) == 1
+
+
+def test_get_digest():
+    assert get_digest("---\n") == get_digest("---\n")
+    assert get_digest("---\n") != get_digest("---\n...\n")
+    assert len(get_digest("")) == 64
+
+
+@pytest.fixture
+def http_repo(tmpdir):
+    """
+    Serve a copy of the test repository over HTTP and record the requests
+    """
+    served = str(tmpdir.join("served"))
+    shutil.copytree(test_repo_dir, served)
+    requests = []
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(self.path)
+            return super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    # The `directory` parameter requires Python 3.7+
+    handler = functools.partial(Handler, directory=served)
+    server = http.server.HTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{0}/".format(server.server_port), served, requests
+    server.shutdown()
+
+
+def test_is_remote():
+    assert is_remote("https://example.com/repo/")
+    assert not is_remote("/srv/repo")
+    assert not is_remote("repo")
+
+
+def test_fetch_repodata(tmpdir, http_repo):
+    baseurl, _, requests = http_repo
+    cachedir = str(tmpdir.join("cache"))
+
+    local_path = fetch_repodata(baseurl, cachedir)
+    assert parse_repodata(local_path)[0].name == "python-django-bash-completion"
+    assert len(requests) == 2
+
+    # Only repomd.xml is fetched when the repository didn't change
+    assert fetch_repodata(baseurl, cachedir) == local_path
+    assert len(requests) == 3
+
+
+def test_fetch_repodata_checksum_mismatch(tmpdir, http_repo):
+    baseurl, served, _ = http_repo
+    repomd = createrepo_c.Repomd(os.path.join(served, "repodata", "repomd.xml"))
+    with open(os.path.join(served, repomd["primary"].location_href), "ab") as f:
+        f.write(b"garbage")
+
+    with pytest.raises(ValueError):
+        fetch_repodata(baseurl, str(tmpdir.join("cache")))
+
+
+@pytest.mark.parametrize("revision", [".", "..", "../foo"])
+def test_fetch_repodata_revision_path(tmpdir, http_repo, revision):
+    baseurl, served, _ = http_repo
+    repomd_path = os.path.join(served, "repodata", "repomd.xml")
+    repomd = createrepo_c.Repomd(repomd_path)
+    repomd.set_revision(revision)
+    with open(repomd_path, "w") as f:
+        f.write(repomd.xml_dump())
+
+    cachedir = tmpdir.join("cache")
+    other = cachedir.mkdir("other")
+    local_path = fetch_repodata(baseurl, str(cachedir))
+    assert os.path.dirname(os.path.dirname(local_path)) == str(cachedir)
+    assert other.check(dir=True)
+
+
+# Real-world SRPM file names and their package names
+SRPM_FILENAMES = [
+    ("python-django-3.0.10-3.fc33.src.rpm", "python-django"),
+    ("kernel-5.8.15-301.fc33.src.rpm", "kernel"),
+    ("gcc-c++-10.2.1-5.fc33.src.rpm", "gcc-c++"),
+    ("java-1.8.0-openjdk-1.8.0.272.b10-1.fc33.src.rpm", "java-1.8.0-openjdk"),
+    ("python3.9-3.9.0-1.fc33.src.rpm", "python3.9"),
+    ("perl-Module-Build-0.42.31-2.fc33.src.rpm", "perl-Module-Build"),
+    ("nodejs-14.14.0-1.module_f33+10098+0cc9c6a1.src.rpm", "nodejs"),
+    ("glibc-2.32-1.fc33.src.rpm", "glibc"),
+    ("389-ds-base-1.4.4.4-1.fc33.src.rpm", "389-ds-base"),
+    ("tzdata-2020d-1.fc33.src.rpm", "tzdata"),
+    ("foo-1:2.0-1.el8.src.rpm", "foo"),
+    ("foo-1.0-1.rpm", None),
+    ("foo.src.rpm", None),
+]
+
+
+@pytest.mark.parametrize("filename, name", SRPM_FILENAMES)
+def test_get_srpm_name(filename, name):
+    assert get_srpm_name(filename) == name
+
+
+@pytest.mark.parametrize("filename, name", SRPM_FILENAMES)
+def test_get_srpm_name_same_as_dnf(filename, name):
+    hawkey = pytest.importorskip("hawkey")
+    subject = pytest.importorskip("dnf.subject").Subject(filename[:-4])
+    nevras = subject.get_nevra_possibilities(forms=[hawkey.FORM_NEVRA])
+    names = [nevra.name for nevra in nevras]
+    assert names == ([name] if name else [])
+
+
+def test_cli_to_stdout_with_output_dir(tmpdir, monkeypatch, capsys):
+    output_dir = str(tmpdir.join("out"))
+    monkeypatch.setattr("sys.argv", ["repo2module", "-O", "--output-dir",
+                                     output_dir, test_repo_dir])
+    with pytest.raises(SystemExit) as excinfo:
+        cli()
+    assert excinfo.value.code == 2
+    assert "--to-stdout cannot be used with --output-dir" in capsys.readouterr().err
+    assert not os.path.exists(output_dir)
+
+
 @unittest.skip("Does not work with the latest libmodulemd (2.12.0)")
 def test_repo2module(module_yaml_output):
     # runner = CliRunner()